@@ -1,24 +1,195 @@
 import asyncio
-from typing import Dict, Any
-from fastapi import HTTPException
-from openai import AsyncOpenAI
-from config import Provider
-from base import ProviderTaskRegistry, ProviderRouterRegistry
+import hmac
+import logging
+import math
+import time
+from collections import Counter
+from typing import Dict, Any, List, Callable, Awaitable, AsyncIterator, Optional, Set, Tuple, Type, TypeVar
+from fastapi import HTTPException, Header, Request
+from openai import AsyncOpenAI, APITimeoutError, RateLimitError
+from config import Provider, Config
+from base import BaseHandler, BaseTask, BaseRouter, ProviderTaskRegistry, ProviderRouterRegistry
 from openai_client import OpenAIClient
+from cache import (
+    make_cache_key, get_many, compute_and_cache, get_cached, store_result, find_keys, delete_keys, RedisPool,
+    single_flight, PartialResult
+)
+from embeddings import EmbeddingFormat, EmbeddingMode, EMBEDDING_FIELDS, encode_output, to_base64, dumps
+from scheduler import SchedulerSaturated
+from deadlines import DeadlineExceeded, remaining, set_timeout
+from map_reduce import MapReduceTask, map_version
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
 
 class APIHandler:
+    # Work still running after its response was sent: deferred embeddings, short-circuited routers
+    _background: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def keep_in_background(task: asyncio.Task):
+        APIHandler._background.add(task)
+        task.add_done_callback(APIHandler._background_done)
+
+    @staticmethod
+    def _background_done(task: asyncio.Task):
+        APIHandler._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background work failed: {str(task.exception())}")
+
+    @staticmethod
+    async def drain(timeout: float):
+        """Wait for background work still running, so shutting down does not drop it."""
+        if APIHandler._background:
+            _, pending = await asyncio.wait(set(APIHandler._background), timeout=timeout)
+            if pending:
+                logger.warning(f"Dropping {len(pending)} background tasks still running at shutdown")
+
+    @staticmethod
+    def upstream_error(exc: Exception) -> HTTPException:
+        """Turn upstream saturation into a fast 503/429 carrying Retry-After instead of a 500."""
+        if isinstance(exc, SchedulerSaturated):
+            return HTTPException(
+                status_code=503,
+                detail="The server is at capacity. Please retry later.",
+                headers={"Retry-After": str(math.ceil(exc.retry_after))}
+            )
+        return HTTPException(
+            status_code=429,
+            detail="Upstream rate limit reached. Please retry later.",
+            headers={"Retry-After": exc.response.headers.get("retry-after", "1")}
+        )
+
+    @staticmethod
+    def deadline_error() -> HTTPException:
+        return HTTPException(status_code=504, detail="The request deadline was exceeded.")
+
+    @staticmethod
+    def request_timeout(
+        handler_class: Optional[Type[BaseHandler]], header_timeout: Optional[float]
+    ) -> Optional[float]:
+        """The tighter of the X-Request-Timeout header and the task's or router's own timeout."""
+        configured = getattr(handler_class, "timeout", None) or Config.REQUEST_TIMEOUT
+        timeouts = [timeout for timeout in (header_timeout, configured) if timeout]
+        return min(timeouts) if timeouts else None
+
+    @staticmethod
+    def _apply_own_timeout(handler_class: Type[BaseHandler], since: float):
+        """Tighten the current context's deadline to the handler's own timeout counted from since,
+        for work that runs several handlers under one request deadline."""
+        if handler_class.timeout is None:
+            return
+        own = handler_class.timeout - (time.monotonic() - since)
+        left = remaining()
+        if left is None or own < left:
+            set_timeout(max(own, 0.0))
+
+    @staticmethod
+    async def run_request(request: Request, work: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Await work under a deadline, cancelling it when the deadline passes or the client disconnects.
+
+        OpenAI calls made by work bound their timeouts by the deadline. Computations shared with
+        other requests keep running for them; see SingleFlight.
+        """
+        async def run() -> T:
+            set_timeout(timeout)
+            return await work
+
+        task = asyncio.ensure_future(run())
+        disconnected = asyncio.ensure_future(APIHandler._wait_for_disconnect(request))
+        try:
+            done, _ = await asyncio.wait({task, disconnected}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnected.cancel()
+            if not task.done():
+                task.cancel()
+        if task in done:
+            return task.result()
+        if disconnected in done:
+            logger.info(f"Client disconnected, cancelled {request.url.path}")
+            raise HTTPException(status_code=499, detail="Client closed the request.")
+        raise APIHandler.deadline_error()
+
+    @staticmethod
+    async def _wait_for_disconnect(request: Request):
+        # The body has been read by now, so the next message is the disconnect
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+        if not Config.ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+        if not x_admin_token or not hmac.compare_digest(x_admin_token, Config.ADMIN_TOKEN):
+            raise HTTPException(status_code=401, detail="Invalid admin token")
+
+    @staticmethod
+    def ensure_task(provider: Provider, task_name: str) -> Type[BaseTask]:
+        # Reject unknown names before they reach the cache or metric labels
+        try:
+            return ProviderTaskRegistry.get_task(provider, task_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @staticmethod
+    def ensure_router(provider: Provider, router_name: str) -> Type[BaseRouter]:
+        try:
+            return ProviderRouterRegistry.get_router(provider, router_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @staticmethod
+    def task_cache_key(provider: Provider, task_name: str, request: Dict[str, Any]) -> str:
+        """Key on the validated input and the task's version, so defaulted or extra fields share
+        an entry and template, schema or model changes start a fresh one."""
+        try:
+            task_class = ProviderTaskRegistry.get_task(provider, task_name)
+            canonical = task_class.canonical_input(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return make_cache_key("process_task", {
+            "provider": provider,
+            "task_name": task_name,
+            "version": task_class.cache_version,
+            "request": canonical,
+        })
+
+    @staticmethod
+    def router_cache_key(provider: Provider, router_name: str, request: Dict[str, Any]) -> str:
+        try:
+            router_class = ProviderRouterRegistry.get_router(provider, router_name)
+            canonical = router_class.canonical_input(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return make_cache_key("process_router", {
+            "provider": provider,
+            "router_name": router_name,
+            "version": router_class.cache_version,
+            "request": canonical,
+        })
+
     @staticmethod
     async def process_task(
         provider: Provider,
         task_name: str,
         client: AsyncOpenAI,
-        request: Dict[str, Any]
+        request: Dict[str, Any],
+        embed: Optional[bool] = None
     ) ->  Dict[str, Any]:
         try:
             task_class = ProviderTaskRegistry.get_task(provider, task_name)
-            return await task_class.process(client, request)
+            return await task_class.process(client, request, embed)
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
+        except (SchedulerSaturated, RateLimitError) as e:
+            raise APIHandler.upstream_error(e)
+        except (DeadlineExceeded, APITimeoutError):
+            raise APIHandler.deadline_error()
         
         
     @staticmethod
@@ -26,24 +197,466 @@ class APIHandler:
         provider: Provider,
         router_name: str,
         client: AsyncOpenAI,
-        request: Dict[str, Any]
+        request: Dict[str, Any],
+        embed: Optional[bool] = None
     ) ->  Dict[str, Any]:
         try:
             router_class = ProviderRouterRegistry.get_router(provider, router_name)
-            return await router_class.process(client, request)
+            return await router_class.process(client, request, embed)
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
+        except (SchedulerSaturated, RateLimitError) as e:
+            raise APIHandler.upstream_error(e)
+        except (DeadlineExceeded, APITimeoutError):
+            raise APIHandler.deadline_error()
 
     @staticmethod
-    async def get_available_tasks(provider: Provider) -> Dict[str, Dict[str, Any]]:
-        tasks = ProviderTaskRegistry.get_available_tasks(provider)
-        task_details = {}
-        for task_name in tasks:
-            task_class = ProviderTaskRegistry.get_task(provider, task_name)
-            task_details[task_name] = {
-                "name": task_class.name,
-                "prompt_template": task_class.prompt_template,
-                "input_schema": task_class.input_schema.schema(),
-                "output_schema": task_class.output_schema.schema(),
-            }
-        return task_details
\ No newline at end of file
+    async def apply_embedding_mode(
+        handler_class: Type[BaseHandler],
+        client: AsyncOpenAI,
+        cache_key: Callable[[], str],
+        output: Dict[str, Any],
+        mode: EmbeddingMode
+    ) -> Dict[str, Any]:
+        """Fill in or drop the embedding of a (possibly cached) output according to the mode.
+
+        cache_key is only called when the embedding has to be computed and written back.
+        """
+        field = handler_class.embedding_field
+        if mode == EmbeddingMode.SKIP:
+            return {**output, field: None}
+        if output.get(field) is not None:
+            return output
+        cache_key = cache_key()
+        if mode == EmbeddingMode.INLINE:
+            return await APIHandler._fill_embedding(handler_class, client, cache_key, output)
+        APIHandler.keep_in_background(
+            asyncio.create_task(APIHandler._fill_embedding_in_background(handler_class, client, cache_key, output))
+        )
+        return output
+
+    @staticmethod
+    async def _fill_embedding(
+        handler_class: Type[BaseHandler],
+        client: AsyncOpenAI,
+        cache_key: str,
+        output: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        async def compute():
+            embedded = await handler_class.attach_embedding(client, output)
+            await store_result(cache_key, embedded, labels=(handler_class.provider, handler_class.name))
+            return embedded
+
+        # Concurrent requests for the same entry share one embedding call
+        return await single_flight.do(f"{cache_key}:embedding", compute)
+
+    @staticmethod
+    async def _fill_embedding_in_background(
+        handler_class: Type[BaseHandler],
+        client: AsyncOpenAI,
+        cache_key: str,
+        output: Dict[str, Any]
+    ):
+        # Runs after the response, so the request's deadline no longer applies
+        set_timeout(None)
+        try:
+            await APIHandler._fill_embedding(handler_class, client, cache_key, output)
+        except Exception as e:
+            logger.error(f"Deferred embedding failed for {cache_key}: {str(e)}", exc_info=True)
+
+    @staticmethod
+    async def get_embedding(
+        handler_class: Type[BaseHandler],
+        client: AsyncOpenAI,
+        cache_key: str,
+        embedding_format: EmbeddingFormat = EmbeddingFormat.FLOAT
+    ) -> Dict[str, Any]:
+        """The embedding of a processed request, waiting for or starting its computation if needed."""
+        output = await get_cached(cache_key, labels=(handler_class.provider, handler_class.name))
+        if output is None:
+            raise HTTPException(status_code=404, detail="No result for this request; process it first")
+        output = await APIHandler.apply_embedding_mode(
+            handler_class, client, lambda: cache_key, output, EmbeddingMode.INLINE
+        )
+        embedding = output[handler_class.embedding_field]
+        if embedding_format == EmbeddingFormat.BASE64:
+            return {handler_class.embedding_field: to_base64(embedding)}
+        return {handler_class.embedding_field: embedding}
+
+    @staticmethod
+    async def stream_task(
+        provider: Provider,
+        task_name: str,
+        client: AsyncOpenAI,
+        request: Dict[str, Any],
+        embedding_format: EmbeddingFormat = EmbeddingFormat.FLOAT,
+        header_timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        # Validate before the response starts so bad requests still get a plain 400
+        cache_key = APIHandler.task_cache_key(provider, task_name, request)
+        task_class = ProviderTaskRegistry.get_task(provider, task_name)
+        return APIHandler._stream_events(
+            task_class, client, cache_key, task_class.stream(client, request), embedding_format,
+            APIHandler.request_timeout(task_class, header_timeout)
+        )
+
+    @staticmethod
+    async def stream_router(
+        provider: Provider,
+        router_name: str,
+        client: AsyncOpenAI,
+        request: Dict[str, Any],
+        embedding_format: EmbeddingFormat = EmbeddingFormat.FLOAT,
+        header_timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        cache_key = APIHandler.router_cache_key(provider, router_name, request)
+        router_class = ProviderRouterRegistry.get_router(provider, router_name)
+        return APIHandler._stream_events(
+            router_class, client, cache_key, router_class.stream(client, request), embedding_format,
+            APIHandler.request_timeout(router_class, header_timeout)
+        )
+
+    @staticmethod
+    async def _stream_events(
+        handler_class: Type[BaseHandler],
+        client: AsyncOpenAI,
+        cache_key: str,
+        events: AsyncIterator[Tuple[str, Dict[str, Any]]],
+        embedding_format: EmbeddingFormat,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """Render stream() events as SSE, closing with "result", "embedding" and "done" events.
+
+        Cache hits are replayed as the closing events only; fresh results are written to the same
+        cache entry the non-streaming endpoint uses. A client disconnect cancels the stream.
+        """
+        labels = (handler_class.provider, handler_class.name)
+        set_timeout(timeout)
+        try:
+            output = await get_cached(cache_key, labels=labels)
+            sent_result = False
+            if output is None:
+                async for kind, data in events:
+                    if kind == "output":
+                        output = data
+                        continue
+                    yield format_sse(kind, data)
+                    sent_result = sent_result or kind == "result"
+                await store_result(cache_key, output, labels=labels)
+            # Entries stored without an embedding (deferred or skipped) get one now
+            output = await APIHandler.apply_embedding_mode(
+                handler_class, client, lambda: cache_key, output, EmbeddingMode.INLINE
+            )
+            encoded = encode_output(output, embedding_format)
+            embedding = {field: encoded.pop(field) for field in EMBEDDING_FIELDS if field in encoded}
+            if not sent_result:
+                yield format_sse("result", encoded)
+            yield format_sse("embedding", embedding)
+            yield format_sse("done", {})
+        except PartialResult as partial:
+            # Cancelled while embedding: keep the finished completion, outside the cancelled stream
+            APIHandler.keep_in_background(asyncio.ensure_future(store_result(cache_key, partial.result, labels=labels)))
+            raise asyncio.CancelledError()
+        except (DeadlineExceeded, APITimeoutError):
+            error = APIHandler.deadline_error()
+            yield format_sse("error", {"status_code": error.status_code, "detail": error.detail})
+        except ValueError as e:
+            yield format_sse("error", {"status_code": 400, "detail": str(e)})
+        except (SchedulerSaturated, RateLimitError) as e:
+            error = APIHandler.upstream_error(e)
+            yield format_sse("error", {
+                "status_code": error.status_code,
+                "detail": error.detail,
+                "retry_after": error.headers["Retry-After"]
+            })
+        except Exception as e:
+            logger.error(f"Streaming failed: {str(e)}", exc_info=True)
+            yield format_sse("error", {"status_code": 500, "detail": "An unexpected error occurred."})
+
+    @staticmethod
+    async def process_task_batch(
+        provider: Provider,
+        task_name: str,
+        client: AsyncOpenAI,
+        requests: List[Dict[str, Any]],
+        embedding: Optional[EmbeddingMode] = None
+    ) -> List[Dict[str, Any]]:
+        task_class = APIHandler.ensure_task(provider, task_name)
+        mode = embedding or task_class.embedding_mode
+        # Keys match the single-item endpoint so both share cache entries
+        return await APIHandler._process_batch(
+            lambda request: APIHandler.task_cache_key(provider, task_name, request),
+            requests,
+            lambda request: APIHandler.process_task(
+                provider, task_name, client, request, mode == EmbeddingMode.INLINE
+            ),
+            (provider, task_name),
+            lambda key, result: APIHandler.apply_embedding_mode(task_class, client, lambda: key, result, mode)
+        )
+
+    @staticmethod
+    async def process_router_batch(
+        provider: Provider,
+        router_name: str,
+        client: AsyncOpenAI,
+        requests: List[Dict[str, Any]],
+        embedding: Optional[EmbeddingMode] = None
+    ) -> List[Dict[str, Any]]:
+        router_class = APIHandler.ensure_router(provider, router_name)
+        mode = embedding or router_class.embedding_mode
+        return await APIHandler._process_batch(
+            lambda request: APIHandler.router_cache_key(provider, router_name, request),
+            requests,
+            lambda request: APIHandler.process_router(
+                provider, router_name, client, request, mode == EmbeddingMode.INLINE
+            ),
+            (provider, router_name),
+            lambda key, result: APIHandler.apply_embedding_mode(router_class, client, lambda: key, result, mode)
+        )
+
+    @staticmethod
+    def _item_error(e: HTTPException) -> Dict[str, Any]:
+        error = {"status_code": e.status_code, "detail": e.detail}
+        if e.headers and "Retry-After" in e.headers:
+            error["retry_after"] = e.headers["Retry-After"]
+        return {"error": error}
+
+    @staticmethod
+    async def _process_batch(
+        cache_key: Callable[[Dict[str, Any]], str],
+        requests: List[Dict[str, Any]],
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        labels: Tuple[Any, Any],
+        finalize: Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        if len(requests) > Config.BATCH_MAX_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch size {len(requests)} exceeds the limit of {Config.BATCH_MAX_SIZE}"
+            )
+        # Invalid items fail on their own instead of failing the whole batch
+        cache_keys: List[Optional[str]] = []
+        invalid: Dict[int, HTTPException] = {}
+        for index, request in enumerate(requests):
+            try:
+                cache_keys.append(cache_key(request))
+            except HTTPException as e:
+                cache_keys.append(None)
+                invalid[index] = e
+        valid_keys = [key for key in cache_keys if key is not None]
+        found = iter(await get_many(valid_keys, labels=labels) if valid_keys else [])
+        cached = [next(found) if key is not None else None for key in cache_keys]
+        semaphore = asyncio.Semaphore(Config.BATCH_CONCURRENCY)
+
+        async def run_item(index: int, request: Dict[str, Any], cached_result: Any) -> Dict[str, Any]:
+            if index in invalid:
+                return APIHandler._item_error(invalid[index])
+            try:
+                result = cached_result
+                if result is None:
+                    async with semaphore:
+                        result = await compute_and_cache(cache_keys[index], lambda: handler(request), labels=labels)
+                return {"result": await finalize(cache_keys[index], result)}
+            except HTTPException as e:
+                return APIHandler._item_error(e)
+            except Exception as e:
+                logger.error(f"Batch item failed: {str(e)}", exc_info=True)
+                return {"error": {"status_code": 500, "detail": "An unexpected error occurred."}}
+
+        return await asyncio.gather(*(
+            run_item(index, request, cached_result)
+            for index, (request, cached_result) in enumerate(zip(requests, cached))
+        ))
+
+    @staticmethod
+    def _is_flagged(item: Optional[Dict[str, Any]]) -> bool:
+        return bool(item and "result" in item and item["result"].get("router_data", {}).get("flag_content") is True)
+
+    @staticmethod
+    async def process_router_fanout(
+        provider: Provider,
+        router_names: List[str],
+        client: AsyncOpenAI,
+        request: Dict[str, Any],
+        short_circuit: bool = False,
+        embedding: Optional[EmbeddingMode] = None
+    ) -> Dict[str, Any]:
+        """Run several routers on one input concurrently, optionally stopping at the first flag_content.
+
+        Cached results come from a single MGET. With short_circuit, routers not yet started are
+        skipped once one flags the content; calls already in flight finish in the background and
+        are cached for next time. If the request itself is cancelled, so are they. A router with its
+        own timeout gets a 504 in its entry once that passes, even if the request's deadline is later.
+        """
+        fanout_started = time.monotonic()
+        names = list(dict.fromkeys(router_names))
+        if len(names) > Config.BATCH_MAX_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"{len(names)} routers exceeds the limit of {Config.BATCH_MAX_SIZE}"
+            )
+        router_classes = {name: APIHandler.ensure_router(provider, name) for name in names}
+        modes = {name: embedding or router_class.embedding_mode for name, router_class in router_classes.items()}
+
+        results: Dict[str, Dict[str, Any]] = {}
+        cache_keys: Dict[str, str] = {}
+        for name in names:
+            try:
+                cache_keys[name] = APIHandler.router_cache_key(provider, name, request)
+            except HTTPException as e:
+                results[name] = APIHandler._item_error(e)
+        cached = await get_many(list(cache_keys.values()), labels=(provider, None)) if cache_keys else []
+        for name, cached_result in zip(cache_keys, cached):
+            if cached_result is not None:
+                results[name] = {"result": cached_result}
+
+        short_circuited = short_circuit and any(APIHandler._is_flagged(item) for item in results.values())
+        pending = [name for name in cache_keys if name not in results]
+        if pending and not short_circuited:
+            # Routers start in the order given, so list the cheapest or most decisive first
+            semaphore = asyncio.Semaphore(Config.BATCH_CONCURRENCY)
+            # Routers holding a semaphore slot; the others have not called upstream yet
+            started: Set[str] = set()
+
+            async def run_router(name: str) -> Optional[Dict[str, Any]]:
+                """The router's result, or None when it was short-circuited before it started."""
+                nonlocal short_circuited
+                async with semaphore:
+                    if short_circuited:
+                        return None
+                    started.add(name)
+                    try:
+                        APIHandler._apply_own_timeout(router_classes[name], fanout_started)
+                        result = await compute_and_cache(
+                            cache_keys[name],
+                            lambda: APIHandler.process_router(
+                                provider, name, client, request, modes[name] == EmbeddingMode.INLINE
+                            ),
+                            labels=(provider, name)
+                        )
+                    except DeadlineExceeded:
+                        raise APIHandler.deadline_error()
+                    # Decided before the slot is released, so the next router in line sees it
+                    short_circuited = short_circuited or (short_circuit and APIHandler._is_flagged({"result": result}))
+                    return result
+
+            tasks = {asyncio.create_task(run_router(name)): name for name in pending}
+            unfinished = set(tasks)
+            try:
+                while unfinished and not short_circuited:
+                    done, unfinished = await asyncio.wait(unfinished, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        name = tasks[task]
+                        if name not in started:
+                            continue
+                        try:
+                            results[name] = {"result": task.result()}
+                        except HTTPException as e:
+                            results[name] = APIHandler._item_error(e)
+                        except Exception as e:
+                            logger.error(f"Router {name} failed: {str(e)}", exc_info=True)
+                            results[name] = {"error": {"status_code": 500, "detail": "An unexpected error occurred."}}
+            finally:
+                for task in unfinished:
+                    if short_circuited and tasks[task] in started:
+                        APIHandler.keep_in_background(task)
+                    else:
+                        task.cancel()
+
+        async def finalize(name: str):
+            try:
+                results[name] = {"result": await APIHandler.apply_embedding_mode(
+                    router_classes[name], client, lambda: cache_keys[name], results[name]["result"], modes[name]
+                )}
+            except HTTPException as e:
+                results[name] = APIHandler._item_error(e)
+            except Exception as e:
+                logger.error(f"Router {name} embedding failed: {str(e)}", exc_info=True)
+                results[name] = {"error": {"status_code": 500, "detail": "An unexpected error occurred."}}
+
+        await asyncio.gather(*(finalize(name) for name, item in results.items() if "result" in item))
+        return {
+            "results": {name: results.get(name, {"skipped": True}) for name in names},
+            "flagged_by": [name for name in names if APIHandler._is_flagged(results.get(name))],
+            "short_circuited": short_circuited,
+        }
+
+    @staticmethod
+    def _cache_scope(kind: str, provider: Provider, name: str) -> Tuple[str, str]:
+        """Key prefix shared by every cached result of one task or router, and its current version."""
+        if kind == "task":
+            current_version = ProviderTaskRegistry.get_task(provider, name).cache_version
+            prefix = make_cache_key("process_task", {"provider": provider, "task_name": name})
+        else:
+            current_version = ProviderRouterRegistry.get_router(provider, name).cache_version
+            prefix = make_cache_key("process_router", {"provider": provider, "router_name": name})
+        return f"{prefix}:", current_version
+
+    @staticmethod
+    def _map_chunk_scope(kind: str, provider: Provider, name: str) -> Optional[Tuple[str, str]]:
+        """Key prefix and current version of a map-reduce task's per-chunk summaries, None for other handlers."""
+        if kind != "task":
+            return None
+        task_class = ProviderTaskRegistry.get_task(provider, name)
+        if not issubclass(task_class, MapReduceTask):
+            return None
+        prefix = make_cache_key("map_chunk", {"provider": provider, "task_name": name})
+        return f"{prefix}:", map_version(task_class)
+
+    @staticmethod
+    def _key_version(prefix: str, key: str) -> str:
+        # Keys continue with "version:<hash>:request:<hash>" after the prefix
+        parts = key[len(prefix):].split(":")
+        return parts[1] if len(parts) > 1 and parts[0] == "version" else "unversioned"
+
+    @staticmethod
+    async def inspect_cache(kind: str, provider: Provider, name: str, limit: int = 20) -> Dict[str, Any]:
+        report = await APIHandler._inspect_scope(*APIHandler._cache_scope(kind, provider, name), limit)
+        map_chunk_scope = APIHandler._map_chunk_scope(kind, provider, name)
+        if map_chunk_scope:
+            report["map_chunks"] = await APIHandler._inspect_scope(*map_chunk_scope, limit)
+        return report
+
+    @staticmethod
+    async def _inspect_scope(prefix: str, current_version: str, limit: int) -> Dict[str, Any]:
+        keys = await find_keys(prefix)
+        redis = RedisPool.get_client()
+        sample = []
+        for key in keys[:limit]:
+            sample.append({"key": key, "version": APIHandler._key_version(prefix, key), "ttl": await redis.ttl(key)})
+        return {
+            "prefix": prefix,
+            "current_version": current_version,
+            "keys": len(keys),
+            "versions": dict(Counter(APIHandler._key_version(prefix, key) for key in keys)),
+            "sample": sample,
+        }
+
+    @staticmethod
+    async def purge_cache(kind: str, provider: Provider, name: str, stale_only: bool = False) -> Dict[str, Any]:
+        report = await APIHandler._purge_scope(*APIHandler._cache_scope(kind, provider, name), stale_only)
+        map_chunk_scope = APIHandler._map_chunk_scope(kind, provider, name)
+        if map_chunk_scope:
+            report["map_chunks"] = await APIHandler._purge_scope(*map_chunk_scope, stale_only)
+        return report
+
+    @staticmethod
+    async def _purge_scope(prefix: str, current_version: str, stale_only: bool) -> Dict[str, Any]:
+        keys = await find_keys(prefix)
+        if stale_only:
+            keys = [key for key in keys if APIHandler._key_version(prefix, key) != current_version]
+        deleted = await delete_keys(keys)
+        logger.info(f"Purged {deleted} cache entries under {prefix} (stale_only={stale_only})")
+        return {"prefix": prefix, "current_version": current_version, "deleted": deleted}
+
+    @staticmethod
+    def get_available_tasks(provider: Provider) -> Tuple[bytes, str]:
+        return ProviderTaskRegistry.catalog(provider)
+
+    @staticmethod
+    def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        # Weak comparison, as If-None-Match calls for
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
\ No newline at end of file
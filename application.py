@@ -1,23 +1,45 @@
 import os
-from fastapi import FastAPI, Path, Depends, Request, Body
-from fastapi.responses import JSONResponse
-from typing import Dict, Any
+from fastapi import FastAPI, Path, Depends, Request, Body, Query, HTTPException, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from typing import Dict, Any, List, Optional
+import time
 import logging
 import logfire
-from config import Provider
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
+from config import Provider, Config
 from openai_client import OpenAIClient
 from api_handler import APIHandler
-from openai import OpenAI
+from openai import OpenAI, APITimeoutError, RateLimitError
 from contextlib import asynccontextmanager
-from cache import redis_cache
+from cache import redis_cache, RedisPool, cache_writer
+from embeddings import EmbeddingFormat, EmbeddingMode, encode_output, dumps
+from semantic_cache import SemanticCache
+from jobs import JobQueue
+from scheduler import SchedulerSaturated
+from deadlines import DeadlineExceeded
+from metrics import REQUEST_SECONDS
+from base import ProviderTaskRegistry, ProviderRouterRegistry
+from workers import Server, WorkerPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keep proxies from buffering server-sent events
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class JSONBytesResponse(Response):
+    """JSON encoded once with orjson, skipping FastAPI's response validation and jsonable_encoder."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
 
 class Application:
     def __init__(self):
-        self.app = FastAPI()
+        self.app = FastAPI(lifespan=self.lifespan)
         self.setup_routes()
         self.setup_middleware()
         self.setup_exception_handlers()
@@ -27,16 +49,55 @@ class Application:
         self.app.post("/api/v1/{provider}/task/{task_name}")(self.process_task)
         self.app.get("/api/v1/{provider}/tasks")(self.get_available_tasks)
         self.app.post("/api/v1/{provider}/router/{router_name}")(self.process_router)
+        self.app.post("/api/v1/{provider}/routers")(self.process_router_fanout)
+        self.app.post("/api/v1/{provider}/task/{task_name}/batch")(self.process_task_batch)
+        self.app.post("/api/v1/{provider}/router/{router_name}/batch")(self.process_router_batch)
+        self.app.post("/api/v1/{provider}/task/{task_name}/stream")(self.stream_task)
+        self.app.post("/api/v1/{provider}/task/{task_name}/embedding")(self.get_task_embedding)
+        self.app.post("/api/v1/{provider}/router/{router_name}/embedding")(self.get_router_embedding)
+        self.app.post("/api/v1/{provider}/router/{router_name}/stream")(self.stream_router)
+        self.app.post("/api/v1/{provider}/task/{task_name}/jobs", status_code=202)(self.submit_task_job)
+        self.app.post("/api/v1/{provider}/router/{router_name}/jobs", status_code=202)(self.submit_router_job)
+        self.app.get("/api/v1/jobs/{job_id}")(self.get_job)
+        self.app.get("/api/v1/semantic_cache/stats")(self.get_semantic_cache_stats)
+        self.app.get("/metrics")(self.get_metrics)
+        admin = [Depends(APIHandler.require_admin)]
+        self.app.get("/api/v1/admin/cache/{provider}/task/{task_name}", dependencies=admin)(self.inspect_task_cache)
+        self.app.delete("/api/v1/admin/cache/{provider}/task/{task_name}", dependencies=admin)(self.purge_task_cache)
+        self.app.get("/api/v1/admin/cache/{provider}/router/{router_name}", dependencies=admin)(self.inspect_router_cache)
+        self.app.delete("/api/v1/admin/cache/{provider}/router/{router_name}", dependencies=admin)(self.purge_router_cache)
 
     def setup_middleware(self):
         @self.app.middleware("http")
         async def log_requests(request: Request, call_next):
             logger.info(f"Incoming request: {request.method} {request.url}")
+            started = time.perf_counter()
             response = await call_next(request)
+            # Label by route template rather than raw path to keep cardinality bounded
+            route = request.scope.get("route")
+            REQUEST_SECONDS.labels(
+                request.method, getattr(route, "path", "unmatched"), str(response.status_code)
+            ).observe(time.perf_counter() - started)
             logger.info(f"Outgoing response: {response.status_code}")
             return response
 
     def setup_exception_handlers(self):
+        @self.app.exception_handler(SchedulerSaturated)
+        @self.app.exception_handler(RateLimitError)
+        async def upstream_exception_handler(request: Request, exc: Exception):
+            error = APIHandler.upstream_error(exc)
+            return JSONResponse(
+                status_code=error.status_code,
+                content={"detail": error.detail},
+                headers=error.headers,
+            )
+
+        @self.app.exception_handler(DeadlineExceeded)
+        @self.app.exception_handler(APITimeoutError)
+        async def deadline_exception_handler(request: Request, exc: Exception):
+            error = APIHandler.deadline_error()
+            return JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+
         @self.app.exception_handler(Exception)
         async def global_exception_handler(request: Request, exc: Exception):
             logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
@@ -48,6 +109,7 @@ class Application:
             )
 
     def setup_logfire(self):
+        # The only logfire.configure call; other modules just emit spans and logs
         logger.info("Starting Logfire configuration")
         logfire.configure(
             token=os.getenv("LOGFIRE_TOKEN"),  # Set the token
@@ -57,50 +119,410 @@ class Application:
         logfire.instrument_fastapi(self.app)
         logger.info("Logfire configuration completed")
 
-    @redis_cache()
     async def process_task(
         self,
+        http_request: Request,
         provider: Provider = Path(
             ..., description="The provider (github, slack, or discord)"
         ),
         task_name: str = Path(..., description="The name of the task to perform"),
         request: Dict[str, Any] = Body(..., description="The request body"),
-    ) -> Dict[str, Any]:
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embedding as a float list or base64 float32"
+        ),
+        embedding: Optional[EmbeddingMode] = Query(
+            None, description="Compute the embedding inline, deferred (fetch it from .../embedding) or skip it"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504, if sooner than the configured timeout"
+        ),
+    ) -> Response:
         logger.info(f"Processing task: {provider}, {task_name}")
+        task_class = APIHandler.ensure_task(provider, task_name)
+        mode = embedding or task_class.embedding_mode
+
+        async def compute() -> Dict[str, Any]:
+            # The embedding step is part of the request, so it shares its deadline and disconnect handling
+            result = await self.cached_task(
+                provider=provider, task_name=task_name, request=request, embed=mode == EmbeddingMode.INLINE
+            )
+            return await APIHandler.apply_embedding_mode(
+                task_class,
+                OpenAIClient.get_client(),
+                lambda: APIHandler.task_cache_key(provider, task_name, request),
+                result,
+                mode
+            )
+
+        result = await APIHandler.run_request(
+            http_request, compute(), APIHandler.request_timeout(task_class, x_request_timeout)
+        )
+        return JSONBytesResponse(encode_output(result, embedding_format))
+
+    @redis_cache(
+        name="process_task",
+        key=lambda provider, task_name, request, embed: APIHandler.task_cache_key(provider, task_name, request)
+    )
+    async def cached_task(
+        self, provider: Provider, task_name: str, request: Dict[str, Any], embed: bool
+    ) -> Dict[str, Any]:
         client = OpenAIClient.get_client()
-        return await APIHandler.process_task(provider, task_name, client, request)
+        return await APIHandler.process_task(provider, task_name, client, request, embed)
 
     async def get_available_tasks(
         self,
         provider: Provider = Path(
             ..., description="The provider (github, slack, or discord)"
         ),
-    ) -> Dict[str, Dict[str, Any]]:
+        if_none_match: Optional[str] = Header(None),
+    ) -> Response:
         logger.info(f"Getting available tasks for provider: {provider}")
-        return await APIHandler.get_available_tasks(provider)
+        body, etag = APIHandler.get_available_tasks(provider)
+        # Clients may keep the catalog but should revalidate it with If-None-Match
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if APIHandler.etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
 
-    @redis_cache()
     async def process_router(
         self,
+        http_request: Request,
         provider: Provider = Path(
             ..., description="The provider (github, slack, or discord)"
         ),
         router_name: str = Path(..., description="The name of the router to process"),
         request: Dict[str, Any] = Body(..., description="The request body"),
-    ) -> Dict[str, Any]:
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embedding as a float list or base64 float32"
+        ),
+        embedding: Optional[EmbeddingMode] = Query(
+            None, description="Compute the embedding inline, deferred (fetch it from .../embedding) or skip it"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504, if sooner than the configured timeout"
+        ),
+    ) -> Response:
         logger.info(f"Processing router: {provider}, {router_name}")
+        router_class = APIHandler.ensure_router(provider, router_name)
+        mode = embedding or router_class.embedding_mode
+
+        async def compute() -> Dict[str, Any]:
+            result = await self.cached_router(
+                provider=provider, router_name=router_name, request=request, embed=mode == EmbeddingMode.INLINE
+            )
+            return await APIHandler.apply_embedding_mode(
+                router_class,
+                OpenAIClient.get_client(),
+                lambda: APIHandler.router_cache_key(provider, router_name, request),
+                result,
+                mode
+            )
+
+        result = await APIHandler.run_request(
+            http_request, compute(), APIHandler.request_timeout(router_class, x_request_timeout)
+        )
+        return JSONBytesResponse(encode_output(result, embedding_format))
+
+    @redis_cache(
+        name="process_router",
+        key=lambda provider, router_name, request, embed: APIHandler.router_cache_key(provider, router_name, request)
+    )
+    async def cached_router(
+        self, provider: Provider, router_name: str, request: Dict[str, Any], embed: bool
+    ) -> Dict[str, Any]:
         client = OpenAIClient.get_client()
-        return await APIHandler.process_router(provider, router_name, client, request)
+        return await APIHandler.process_router(provider, router_name, client, request, embed)
+
+    async def process_router_fanout(
+        self,
+        http_request: Request,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        routers: List[str] = Query(..., description="The routers to run, in the order they should start"),
+        short_circuit: bool = Query(False, description="Skip the remaining routers once one flags the content"),
+        request: Dict[str, Any] = Body(..., description="The request body, shared by every router"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embeddings as float lists or base64 float32"
+        ),
+        embedding: Optional[EmbeddingMode] = Query(
+            None, description="Compute the embeddings inline, deferred (fetch them from .../embedding) or skip them"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504, if sooner than the configured timeout"
+        ),
+    ) -> Response:
+        logger.info(f"Processing router fan-out: {provider}, {routers}")
+        client = OpenAIClient.get_client()
+        combined = await APIHandler.run_request(
+            http_request,
+            APIHandler.process_router_fanout(provider, routers, client, request, short_circuit, embedding),
+            APIHandler.request_timeout(None, x_request_timeout),
+        )
+        combined["results"] = {
+            name: {"result": encode_output(item["result"], embedding_format)} if "result" in item else item
+            for name, item in combined["results"].items()
+        }
+        return JSONBytesResponse(combined)
+
+    async def stream_task(
+        self,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        task_name: str = Path(..., description="The name of the task to perform"),
+        request: Dict[str, Any] = Body(..., description="The request body"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embedding as a float list or base64 float32"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504 error event"
+        ),
+    ) -> StreamingResponse:
+        logger.info(f"Streaming task: {provider}, {task_name}")
+        client = OpenAIClient.get_client()
+        events = await APIHandler.stream_task(
+            provider, task_name, client, request, embedding_format, x_request_timeout
+        )
+        return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+    async def process_task_batch(
+        self,
+        http_request: Request,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        task_name: str = Path(..., description="The name of the task to perform"),
+        requests: List[Dict[str, Any]] = Body(..., description="The request bodies, one per item"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embeddings as float lists or base64 float32"
+        ),
+        embedding: Optional[EmbeddingMode] = Query(
+            None, description="Compute the embeddings inline, deferred (fetch them from .../embedding) or skip them"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504, if sooner than the configured timeout"
+        ),
+    ) -> Response:
+        logger.info(f"Processing task batch: {provider}, {task_name}, {len(requests)} items")
+        timeout = APIHandler.request_timeout(APIHandler.ensure_task(provider, task_name), x_request_timeout)
+        client = OpenAIClient.get_client()
+        items = await APIHandler.run_request(
+            http_request, APIHandler.process_task_batch(provider, task_name, client, requests, embedding), timeout
+        )
+        return JSONBytesResponse([
+            {"result": encode_output(item["result"], embedding_format)} if "result" in item else item
+            for item in items
+        ])
+
+    async def stream_router(
+        self,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        router_name: str = Path(..., description="The name of the router to process"),
+        request: Dict[str, Any] = Body(..., description="The request body"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embedding as a float list or base64 float32"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504 error event"
+        ),
+    ) -> StreamingResponse:
+        logger.info(f"Streaming router: {provider}, {router_name}")
+        client = OpenAIClient.get_client()
+        events = await APIHandler.stream_router(
+            provider, router_name, client, request, embedding_format, x_request_timeout
+        )
+        return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+    async def process_router_batch(
+        self,
+        http_request: Request,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        router_name: str = Path(..., description="The name of the router to process"),
+        requests: List[Dict[str, Any]] = Body(..., description="The request bodies, one per item"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embeddings as float lists or base64 float32"
+        ),
+        embedding: Optional[EmbeddingMode] = Query(
+            None, description="Compute the embeddings inline, deferred (fetch them from .../embedding) or skip them"
+        ),
+        x_request_timeout: Optional[float] = Header(
+            None, gt=0, description="Seconds after which to give up with a 504, if sooner than the configured timeout"
+        ),
+    ) -> Response:
+        logger.info(f"Processing router batch: {provider}, {router_name}, {len(requests)} items")
+        timeout = APIHandler.request_timeout(APIHandler.ensure_router(provider, router_name), x_request_timeout)
+        client = OpenAIClient.get_client()
+        items = await APIHandler.run_request(
+            http_request, APIHandler.process_router_batch(provider, router_name, client, requests, embedding), timeout
+        )
+        return JSONBytesResponse([
+            {"result": encode_output(item["result"], embedding_format)} if "result" in item else item
+            for item in items
+        ])
+
+    async def submit_task_job(
+        self,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        task_name: str = Path(..., description="The name of the task to perform"),
+        request: Dict[str, Any] = Body(..., description="The request body"),
+        callback_url: Optional[str] = Query(None, description="URL to POST the finished job to"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Embedding format of the result and callback"
+        ),
+    ) -> Dict[str, Any]:
+        logger.info(f"Submitting task job: {provider}, {task_name}")
+        APIHandler.ensure_task(provider, task_name)
+        cache_key = APIHandler.task_cache_key(provider, task_name, request)
+        return await JobQueue.submit("task", provider, task_name, request, cache_key, callback_url, embedding_format)
+
+    async def submit_router_job(
+        self,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        router_name: str = Path(..., description="The name of the router to process"),
+        request: Dict[str, Any] = Body(..., description="The request body"),
+        callback_url: Optional[str] = Query(None, description="URL to POST the finished job to"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Embedding format of the result and callback"
+        ),
+    ) -> Dict[str, Any]:
+        logger.info(f"Submitting router job: {provider}, {router_name}")
+        APIHandler.ensure_router(provider, router_name)
+        cache_key = APIHandler.router_cache_key(provider, router_name, request)
+        return await JobQueue.submit("router", provider, router_name, request, cache_key, callback_url, embedding_format)
+
+    async def get_job(
+        self,
+        job_id: str = Path(..., description="The id returned when the job was submitted"),
+        embedding_format: Optional[EmbeddingFormat] = Query(
+            None, description="Override the embedding format chosen at submission"
+        ),
+    ) -> Response:
+        job = await JobQueue.get(job_id, embedding_format)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+        return JSONBytesResponse(job)
+
+    async def get_task_embedding(
+        self,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        task_name: str = Path(..., description="The name of the task"),
+        request: Dict[str, Any] = Body(..., description="The request body the task was run with"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embedding as a float list or base64 float32"
+        ),
+    ) -> Response:
+        task_class = APIHandler.ensure_task(provider, task_name)
+        cache_key = APIHandler.task_cache_key(provider, task_name, request)
+        embedding = await APIHandler.get_embedding(task_class, OpenAIClient.get_client(), cache_key, embedding_format)
+        return JSONBytesResponse(embedding)
+
+    async def get_router_embedding(
+        self,
+        provider: Provider = Path(
+            ..., description="The provider (github, slack, or discord)"
+        ),
+        router_name: str = Path(..., description="The name of the router"),
+        request: Dict[str, Any] = Body(..., description="The request body the router was run with"),
+        embedding_format: EmbeddingFormat = Query(
+            EmbeddingFormat.FLOAT, description="Return the embedding as a float list or base64 float32"
+        ),
+    ) -> Response:
+        router_class = APIHandler.ensure_router(provider, router_name)
+        cache_key = APIHandler.router_cache_key(provider, router_name, request)
+        embedding = await APIHandler.get_embedding(router_class, OpenAIClient.get_client(), cache_key, embedding_format)
+        return JSONBytesResponse(embedding)
+
+    async def get_semantic_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        return SemanticCache.stats()
+
+    async def get_metrics(self) -> Response:
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            # Aggregate over all worker processes rather than just the one answering
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    async def inspect_task_cache(
+        self,
+        provider: Provider = Path(..., description="The provider"),
+        task_name: str = Path(..., description="The task whose cache entries to inspect"),
+        limit: int = Query(20, ge=0, le=1000, description="Number of sample keys to return"),
+    ) -> Dict[str, Any]:
+        APIHandler.ensure_task(provider, task_name)
+        return await APIHandler.inspect_cache("task", provider, task_name, limit)
+
+    async def purge_task_cache(
+        self,
+        provider: Provider = Path(..., description="The provider"),
+        task_name: str = Path(..., description="The task whose cache entries to delete"),
+        stale_only: bool = Query(False, description="Only delete entries from earlier task versions"),
+    ) -> Dict[str, Any]:
+        APIHandler.ensure_task(provider, task_name)
+        return await APIHandler.purge_cache("task", provider, task_name, stale_only)
+
+    async def inspect_router_cache(
+        self,
+        provider: Provider = Path(..., description="The provider"),
+        router_name: str = Path(..., description="The router whose cache entries to inspect"),
+        limit: int = Query(20, ge=0, le=1000, description="Number of sample keys to return"),
+    ) -> Dict[str, Any]:
+        APIHandler.ensure_router(provider, router_name)
+        return await APIHandler.inspect_cache("router", provider, router_name, limit)
+
+    async def purge_router_cache(
+        self,
+        provider: Provider = Path(..., description="The provider"),
+        router_name: str = Path(..., description="The router whose cache entries to delete"),
+        stale_only: bool = Query(False, description="Only delete entries from earlier router versions"),
+    ) -> Dict[str, Any]:
+        APIHandler.ensure_router(provider, router_name)
+        return await APIHandler.purge_cache("router", provider, router_name, stale_only)
 
     @asynccontextmanager
     async def lifespan(self, app: FastAPI):
         # Setup
         logger.info("Application startup")
+        RedisPool.connect()
+        cache_writer.start()
+        OpenAIClient.startup()
+        JobQueue.start()
         yield
-        # Cleanup
+        # Cleanup; uvicorn has already drained in-flight requests, and jobs and background work
+        # only get what is left of the same GRACEFUL_TIMEOUT budget
+        await JobQueue.stop(Server.shutdown_remaining(Config.GRACEFUL_TIMEOUT))
+        await APIHandler.drain(Server.shutdown_remaining(Config.GRACEFUL_TIMEOUT))
+        await cache_writer.stop()
+        await OpenAIClient.shutdown()
+        await RedisPool.disconnect()
         logger.info("Application shutdown")
 
     def run(self):
         import uvicorn
 
-        uvicorn.run(self.app, host="0.0.0.0", port=8011, lifespan="on")
+        config = uvicorn.Config(
+            self.app,
+            host=Config.HOST,
+            port=Config.PORT,
+            lifespan="on",
+            timeout_graceful_shutdown=Config.GRACEFUL_TIMEOUT,
+        )
+        if Config.WORKERS > 1:
+            # Import every task and router before forking, so workers (and their replacements)
+            # start with them loaded instead of each importing them on first use
+            ProviderTaskRegistry.load_all()
+            ProviderRouterRegistry.load_all()
+            WorkerPool(config, Config.WORKERS).run()
+        else:
+            Server(config).run()
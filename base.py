@@ -1,130 +1,344 @@
+import asyncio
+import hashlib
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Type, ClassVar, List
+from typing import Dict, Any, Type, ClassVar, List, Optional, Tuple, AsyncIterator
+import numpy as np
+import orjson
 from pydantic import BaseModel
 from openai import AsyncOpenAI
-from config import Provider
+from config import Config, Provider
 from template_renderer import TemplateRenderer
-from openai_client import OpenAIClient
+from openai_client import OpenAIClient, COMPLETION_MODEL, EMBEDDING_MODEL
+from semantic_cache import SemanticCache
+from metrics import observe_stage, record_cache_lookup
+from embeddings import EmbeddingMode
+from cache import PartialResult
+from loaders import import_module
 
-class TaskOutput(BaseModel):
-    action_type: str
-    action_data: Dict[str, Any]
-    action_embedding: List[float]
+def compute_cache_version(task_class) -> str:
+    """Hash of everything besides the input that shapes a task's or router's output."""
+    fingerprint = {
+        "templates": task_class.templates(),
+        "input_schema": task_class.input_schema.model_json_schema(),
+        "output_schema": task_class.output_schema.model_json_schema(),
+        "completion_models": task_class.models(),
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_dimensions": task_class.embedding_dimensions,
+    }
+    return hashlib.blake2b(orjson.dumps(fingerprint, option=orjson.OPT_SORT_KEYS), digest_size=6).hexdigest()
 
-class BaseTask(ABC):
+class BaseHandler(ABC):
+    """What tasks and routers share: validate the input, try the semantic cache, run a structured
+    (optionally cascaded) completion over the rendered messages and embed its output."""
     name: ClassVar[str]
     prompt_template: ClassVar[str]
     input_schema: ClassVar[Type[BaseModel]]
     output_schema: ClassVar[Type[BaseModel]]
+    embedding_dimensions: ClassVar[Optional[int]] = None
+    # Keys of the output dict: the handler name, the completion output and its embedding
+    type_field: ClassVar[str]
+    data_field: ClassVar[str]
+    embedding_field: ClassVar[str]
+    # Set by the registry when the class is registered
+    provider: ClassVar[Optional[Provider]] = None
+    cache_version: ClassVar[Optional[str]] = None
+    # Reuse the output of a previous input at least this similar; None disables semantic caching
+    semantic_cache_threshold: ClassVar[Optional[float]] = None
+    # Default for requests that do not pass ?embedding=
+    embedding_mode: ClassVar[EmbeddingMode] = EmbeddingMode.INLINE
+    # Completion model, None for COMPLETION_MODEL; both can be overridden per name with MODEL_OVERRIDES
+    model: ClassVar[Optional[str]] = None
+    # A smaller model to try first, escalating to `model` when its output is invalid or not confident
+    cascade_model: ClassVar[Optional[str]] = None
+    # Seconds a request may take before it is cancelled with a 504; None for REQUEST_TIMEOUT
+    timeout: ClassVar[Optional[float]] = None
 
     @classmethod
-    async def process(cls, client: AsyncOpenAI, input_data: Dict[str, Any]) -> Dict[str, Any]:
-        validated_input = cls.input_schema(**input_data)
-        prompt = TemplateRenderer.render(cls.prompt_template, **validated_input.model_dump())
-        print(prompt)
-        response_output = await OpenAIClient.completion(client, prompt, cls.output_schema)
-        
-        output_json = response_output.model_dump_json()
-        embedding = await OpenAIClient.generate_embedding(client, output_json)
-        
-        return TaskOutput(
-            action_type=cls.name,
-            action_data=response_output.model_dump(),
-            action_embedding=embedding
-        ).model_dump()
-
-class ProviderTaskRegistry:
-    _providers: Dict[Provider, Dict[str, Type[BaseTask]]] = {provider: {} for provider in Provider}
+    @abstractmethod
+    def templates(cls) -> Dict[str, str]:
+        """Every template that shapes the prompt, by name."""
+
+    @classmethod
+    @abstractmethod
+    def messages(cls, validated_input: BaseModel) -> List[Dict[str, str]]:
+        """The chat messages for the validated input."""
+
+    @classmethod
+    def models(cls) -> List[str]:
+        """Models to try in order; the last one is the model used without a cascade."""
+        model = cls.model or COMPLETION_MODEL
+        return [cls.cascade_model, model] if cls.cascade_model else [model]
+
+    @classmethod
+    def confidence_check(cls, response_output: BaseModel) -> bool:
+        """Whether a cascade can keep a valid answer from a smaller model instead of escalating."""
+        return True
+
+    @classmethod
+    def canonical_input(cls, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """The validated input with defaults filled in and unknown fields dropped, as used in cache keys."""
+        return cls.input_schema(**input_data).model_dump(mode="json")
+
+    @classmethod
+    def semantic_cache_name(cls) -> str:
+        # Names are only unique per provider, like the result cache keys
+        return f"{cls.provider.value}:{cls.name}:{cls.cache_version}"
+
+    @classmethod
+    async def semantic_lookup(
+        cls, client: AsyncOpenAI, validated_input: BaseModel
+    ) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+        """Return the input embedding and a semantically cached output, when semantic caching is on."""
+        if cls.semantic_cache_threshold is None:
+            return None, None
+        with observe_stage("semantic_cache", cls.provider, cls.name):
+            input_embedding = await OpenAIClient.generate_embedding(
+                client, validated_input.model_dump_json(), cls.embedding_dimensions
+            )
+            cached_output = await SemanticCache.lookup(
+                cls.semantic_cache_name(), input_embedding, cls.semantic_cache_threshold
+            )
+        record_cache_lookup("semantic", cached_output is not None, cls.provider, cls.name)
+        return input_embedding, cached_output
+
+    @classmethod
+    async def embed_output(cls, client: AsyncOpenAI, response_data: Dict[str, Any]) -> np.ndarray:
+        # Same compact JSON as model_dump_json(), from the dict the output already has
+        with observe_stage("embedding", cls.provider, cls.name):
+            return await OpenAIClient.generate_embedding(
+                client, orjson.dumps(response_data).decode(), cls.embedding_dimensions
+            )
+
+    @classmethod
+    async def attach_embedding(cls, client: AsyncOpenAI, output: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the embedding to an output built without one."""
+        return {**output, cls.embedding_field: await cls.embed_output(client, output[cls.data_field])}
+
+    @classmethod
+    async def build_output(
+        cls,
+        client: AsyncOpenAI,
+        response_data: Dict[str, Any],
+        input_embedding: Optional[np.ndarray],
+        embed: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """The output dict ({type_field, data_field, embedding_field}) for the dumped completion
+        output; response_data is already validated, so no model is built around it."""
+        if embed is None:
+            embed = cls.embedding_mode == EmbeddingMode.INLINE
+        output = {
+            cls.type_field: cls.name,
+            cls.data_field: response_data,
+            cls.embedding_field: None,
+        }
+        if embed:
+            try:
+                output[cls.embedding_field] = await cls.embed_output(client, response_data)
+            except asyncio.CancelledError:
+                # The completion is paid for; cache it and let a later read add the embedding
+                raise PartialResult(output)
+        if input_embedding is not None:
+            await SemanticCache.store(cls.semantic_cache_name(), input_embedding, output)
+        return output
+
+    @classmethod
+    async def process(
+        cls, client: AsyncOpenAI, input_data: Dict[str, Any], embed: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        with observe_stage("validation", cls.provider, cls.name):
+            validated_input = cls.input_schema(**input_data)
+        input_embedding, cached_output = await cls.semantic_lookup(client, validated_input)
+        if cached_output is not None:
+            return cached_output
+
+        with observe_stage("render", cls.provider, cls.name):
+            messages = cls.messages(validated_input)
+        with observe_stage("completion", cls.provider, cls.name):
+            response_output = await OpenAIClient.cascade_parse(
+                client, messages, cls.output_schema, cls.provider, cls.name, cls.models(), cls.confidence_check
+            )
+        return await cls.build_output(client, response_output.model_dump(), input_embedding, embed)
+
+    @classmethod
+    async def stream(cls, client: AsyncOpenAI, input_data: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Yield ("partial", data) while the completion streams, ("result", data) once it is
+        validated, and ("output", output) once the embedding is attached."""
+        with observe_stage("validation", cls.provider, cls.name):
+            validated_input = cls.input_schema(**input_data)
+        input_embedding, cached_output = await cls.semantic_lookup(client, validated_input)
+        if cached_output is not None:
+            yield "output", cached_output
+            return
+
+        with observe_stage("render", cls.provider, cls.name):
+            messages = cls.messages(validated_input)
+        with observe_stage("completion", cls.provider, cls.name):
+            # Partial output is already on its way to the client, so streams skip the cascade
+            async for response_output in OpenAIClient.stream_parse(
+                client, messages, cls.output_schema, cls.provider, cls.name, cls.models()[-1]
+            ):
+                if isinstance(response_output, dict):
+                    yield "partial", response_output
+        response_data = response_output.model_dump()
+        yield "result", {cls.type_field: cls.name, cls.data_field: response_data}
+        yield "output", await cls.build_output(client, response_data, input_embedding)
+
+class ProviderRegistry:
+    """Tasks or routers by provider and name, imported on first lookup when known from the manifest.
+
+    Subclasses set their own _providers and _modules.
+    """
+    _providers: Dict[Provider, Dict[str, Type[BaseHandler]]]
+    # Name -> module, for classes known from the manifest whose module is not imported yet
+    _modules: Dict[Provider, Dict[str, str]]
 
     @classmethod
     def register(cls, provider: Provider):
-        def decorator(task_class: Type[BaseTask]):
-            cls._providers[provider][task_class.name] = task_class
-            return task_class
+        def decorator(handler_class: Type[BaseHandler]):
+            # Compile up front so template errors surface on import rather than on a request
+            for template in handler_class.templates().values():
+                TemplateRenderer.compile(template)
+            handler_class.provider = provider
+            overrides = Config.MODEL_OVERRIDES.get(handler_class.name, {})
+            handler_class.model = overrides.get("model", handler_class.model)
+            handler_class.cascade_model = overrides.get("cascade_model", handler_class.cascade_model)
+            handler_class.cache_version = compute_cache_version(handler_class)
+            cls._providers[provider][handler_class.name] = handler_class
+            cls._modules[provider].pop(handler_class.name, None)
+            cls._changed(provider)
+            return handler_class
         return decorator
 
     @classmethod
-    def get_task(cls, provider: Provider, task_name: str) -> Type[BaseTask]:
-        provider_tasks = cls._providers.get(provider)
-        if not provider_tasks:
+    def _changed(cls, provider: Provider):
+        """Called when a name is registered or becomes known from the manifest."""
+
+    @classmethod
+    def add_module(cls, provider: Provider, name: str, module_name: str):
+        """Make a class known by name; its module is imported the first time the name is looked up."""
+        if name not in cls._providers[provider]:
+            cls._modules[provider][name] = module_name
+            cls._changed(provider)
+
+    @classmethod
+    def load_all(cls, provider: Optional[Provider] = None):
+        """Import the modules of every class not imported yet, for one provider or all of them."""
+        for pending in [cls._modules[provider]] if provider else cls._modules.values():
+            for name, module_name in list(pending.items()):
+                import_module(module_name)
+                pending.pop(name, None)
+
+    @classmethod
+    def _get(cls, provider: Provider, name: str, kind: str) -> Type[BaseHandler]:
+        registered = cls._providers.get(provider)
+        if not registered and not cls._modules.get(provider):
             raise ValueError(f"Unknown provider: {provider}")
-        task = provider_tasks.get(task_name)
-        if not task:
-            raise ValueError(f"Unknown task type for provider {provider}: {task_name}")
-        return task
+        if name in cls._modules[provider]:
+            import_module(cls._modules[provider][name])
+            cls._modules[provider].pop(name, None)
+        handler_class = registered.get(name)
+        if not handler_class:
+            raise ValueError(f"Unknown {kind} type for provider {provider}: {name}")
+        return handler_class
+
+    @classmethod
+    def _available(cls, provider: Provider) -> List[str]:
+        return list(cls._providers[provider].keys()) + list(cls._modules[provider].keys())
+
+class BaseTask(BaseHandler):
+    type_field: ClassVar[str] = 'action_type'
+    data_field: ClassVar[str] = 'action_data'
+    embedding_field: ClassVar[str] = 'action_embedding'
+
+    @classmethod
+    def templates(cls) -> Dict[str, str]:
+        return {'prompt': cls.prompt_template}
+
+    @classmethod
+    def messages(cls, validated_input: BaseModel) -> List[Dict[str, str]]:
+        return OpenAIClient.completion_messages(
+            TemplateRenderer.render(cls.prompt_template, **validated_input.model_dump())
+        )
+
+class ProviderTaskRegistry(ProviderRegistry):
+    _providers: Dict[Provider, Dict[str, Type[BaseTask]]] = {provider: {} for provider in Provider}
+    _modules: Dict[Provider, Dict[str, str]] = {provider: {} for provider in Provider}
+    # Serialized task list and ETag per provider, rebuilt after a task registers
+    _catalogs: Dict[Provider, Tuple[bytes, str]] = {}
+
+    @classmethod
+    def _changed(cls, provider: Provider):
+        cls._catalogs.pop(provider, None)
+
+    @classmethod
+    def _build_catalog(cls, provider: Provider) -> Tuple[bytes, str]:
+        body = orjson.dumps({
+            task_class.name: {
+                "name": task_class.name,
+                "prompt_template": task_class.prompt_template,
+                "input_schema": task_class.input_schema.model_json_schema(),
+                "output_schema": task_class.output_schema.model_json_schema(),
+            }
+            for task_class in cls._providers[provider].values()
+        })
+        return body, f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+    @classmethod
+    def catalog(cls, provider: Provider) -> Tuple[bytes, str]:
+        """The provider's tasks with their schemas as JSON bytes, and the ETag of those bytes."""
+        # The catalog includes schemas, so it needs every task of the provider imported
+        cls.load_all(provider)
+        if provider not in cls._catalogs:
+            cls._catalogs[provider] = cls._build_catalog(provider)
+        return cls._catalogs[provider]
+
+    @classmethod
+    def get_task(cls, provider: Provider, task_name: str) -> Type[BaseTask]:
+        return cls._get(provider, task_name, "task")
 
     @classmethod
     def get_available_tasks(cls, provider: Provider) -> List[str]:
-        return list(cls._providers[provider].keys())
+        return cls._available(provider)
     
-class RouterOutput(BaseModel):
-    router_type: str
-    router_data: Dict[str, Any]
-    router_embedding: List[float]
-    
-class BaseRouter(ABC):
-    name: ClassVar[str]
+class BaseRouter(BaseHandler):
     instruction_template: ClassVar[str]
     context_template: ClassVar[str]
     format_instructions: ClassVar[str]
-    prompt_template: ClassVar[str]
-    input_schema: ClassVar[Type[BaseModel]]
-    output_schema: ClassVar[Type[BaseModel]]
-    
+    type_field: ClassVar[str] = 'router_type'
+    data_field: ClassVar[str] = 'router_data'
+    embedding_field: ClassVar[str] = 'router_embedding'
+
     @classmethod
-    async def process(cls, client: AsyncOpenAI, input_data: Dict[str, Any]) -> Dict[str, Any]:
-        validated_input = cls.input_schema(**input_data)
-        
-        templates = {
+    def templates(cls) -> Dict[str, str]:
+        return {
             'instructions': cls.instruction_template,
             'context': cls.context_template,
             'format_instructions': cls.format_instructions,
             'prompt': cls.prompt_template,
         }
-        
-        rendered = {key: TemplateRenderer.render(template, **validated_input.model_dump())
-                    for key, template in templates.items()}
-        
-        response_output = await OpenAIClient.router_call(
-            client,
-            instructions=rendered['instructions'],
-            context=rendered['context'],
-            format_instructions=rendered['format_instructions'],
-            prompt=rendered['prompt'],
-            response_format=cls.output_schema
+
+    @classmethod
+    def render(cls, validated_input: BaseModel) -> Dict[str, str]:
+        variables = validated_input.model_dump()
+        return {key: TemplateRenderer.render(template, **variables)
+                for key, template in cls.templates().items()}
+
+    @classmethod
+    def messages(cls, validated_input: BaseModel) -> List[Dict[str, str]]:
+        rendered = cls.render(validated_input)
+        return OpenAIClient.router_messages(
+            rendered['instructions'], rendered['context'], rendered['format_instructions'], rendered['prompt']
         )
-        
-        output_json = response_output.model_dump_json()
-        embedding = await OpenAIClient.generate_embedding(client, output_json)
-    
-        return RouterOutput(
-            router_type=cls.name,
-            router_data=response_output.model_dump(),
-            router_embedding=embedding
-        ).model_dump()
 
     
-class ProviderRouterRegistry:
+class ProviderRouterRegistry(ProviderRegistry):
     _providers: Dict[Provider, Dict[str, Type[BaseRouter]]] = {provider: {} for provider in Provider}
-    
-    @classmethod
-    def register(cls, provider: Provider):
-        def decorator(task_class: Type[BaseRouter]):
-            cls._providers[provider][task_class.name] = task_class
-            return task_class
-        return decorator
-    
+    _modules: Dict[Provider, Dict[str, str]] = {provider: {} for provider in Provider}
+
     @classmethod
     def get_router(cls, provider: Provider, router_name: str) -> Type[BaseRouter]:
-        provider_routers = cls._providers.get(provider)
-        if not provider_routers:
-            raise ValueError(f"Unknown provider: {provider}")
-        router = provider_routers.get(router_name)
-        if not router:
-            raise ValueError(f"Unknown router type for provider {provider}: {router_name}")
-        return router
-    
+        return cls._get(provider, router_name, "router")
     
     @classmethod
     def get_available_routers(cls, provider: Provider) -> List[str]:
-        return list(cls._providers[provider].keys())
\ No newline at end of file
+        return cls._available(provider)
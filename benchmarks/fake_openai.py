@@ -0,0 +1,165 @@
+"""A local stand-in for the OpenAI API, used to measure the server's own overhead.
+
+Implements just enough of /v1/chat/completions (structured outputs, optionally streamed) and
+/v1/embeddings for the server to run against, with configurable latency, output size and
+injected 429s. Call counts are served at /stats.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import zlib
+from typing import Any, Dict
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = "the quick brown fox jumps over a lazy dog while summaries flow through the server".split()
+
+
+def build_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI()
+    stats = {"chat_completions": 0, "embeddings": 0, "embedding_inputs": 0, "rate_limited": 0}
+
+    async def simulate_latency(mean_ms: float):
+        delay = max(random.gauss(mean_ms, args.jitter_ms), 0.0) / 1000
+        await asyncio.sleep(delay)
+
+    def rate_limited():
+        if random.random() < args.error_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"retry-after": "1"},
+            )
+        return None
+
+    def instance(schema: Dict[str, Any], defs: Dict[str, Any]) -> Any:
+        if "$ref" in schema:
+            return instance(defs[schema["$ref"].split("/")[-1]], defs)
+        if "anyOf" in schema:
+            return instance(schema["anyOf"][0], defs)
+        kind = schema.get("type")
+        if kind == "object":
+            return {key: instance(value, defs) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            return [instance(schema["items"], defs) for _ in range(3)]
+        if kind == "string":
+            return " ".join(random.choice(WORDS) for _ in range(args.string_words))
+        if kind == "boolean":
+            return random.random() < 0.5
+        if kind == "integer":
+            return random.randint(0, 100)
+        if kind == "number":
+            return random.random()
+        return None
+
+    def usage(body: Dict[str, Any], content: str) -> Dict[str, int]:
+        prompt_tokens = sum(len(message.get("content") or "") for message in body["messages"]) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["chat_completions"] += 1
+        limited = rate_limited()
+        if limited is not None:
+            return limited
+        schema = body["response_format"]["json_schema"]["schema"]
+        content = json.dumps(instance(schema, schema.get("$defs", {})))
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body["model"]}
+
+        if body.get("stream"):
+            async def chunks():
+                await simulate_latency(args.first_token_ms)
+                pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+                pause = max(args.latency_ms - args.first_token_ms, 0) / 1000 / max(len(pieces), 1)
+                first = {"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [first]})}\n\n"
+                for piece in pieces:
+                    choice = {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                    yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [choice]})}\n\n"
+                    await asyncio.sleep(pause)
+                last = {"index": 0, "delta": {}, "finish_reason": "stop"}
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [last]})}\n\n"
+                final = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage(body, content)}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        await simulate_latency(args.latency_ms)
+        return {
+            **base,
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": usage(body, content),
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        stats["embeddings"] += 1
+        stats["embedding_inputs"] += len(inputs)
+        limited = rate_limited()
+        if limited is not None:
+            return limited
+        await simulate_latency(args.embedding_latency_ms)
+        dimensions = body.get("dimensions") or args.dimensions
+        data = []
+        for index, text in enumerate(inputs):
+            # Deterministic per input so identical texts embed identically
+            vector = np.random.default_rng(zlib.crc32(text.encode())).random(dimensions, dtype=np.float32)
+            vector /= np.linalg.norm(vector)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text) for text in inputs) // 4
+        return {
+            "object": "list",
+            "data": data,
+            "model": body["model"],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Mean completion latency")
+    parser.add_argument("--first-token-ms", type=float, default=50, help="Latency before the first streamed chunk")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Mean embedding latency")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Standard deviation of injected latency")
+    parser.add_argument("--string-words", type=int, default=40, help="Words per generated string field")
+    parser.add_argument("--dimensions", type=int, default=3072, help="Default embedding dimensions")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    uvicorn.run(build_app(arguments), host=arguments.host, port=arguments.port, log_level="warning")
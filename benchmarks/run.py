@@ -0,0 +1,322 @@
+"""Replay a JSONL traffic file against a locally booted server and report machine-readable results.
+
+The server is started from main.py as a subprocess, pointed at the local OpenAI stand-in in
+fake_openai.py and at either a real Redis (--redis-url) or an in-process fakeredis server
+(--fake-redis). Requests are sent open-loop at the target rate, so a slow server shows up as
+latency instead of silently lowering the offered load.
+
+Each traffic line is a JSON object:
+
+    {"endpoint": "task", "provider": "summarization", "name": "generic_summarization_task", "body": {...}}
+
+where endpoint is one of task, router, task_batch, router_batch, task_stream or router_stream
+(batch bodies are lists of request bodies).
+
+Example:
+
+    python benchmarks/run.py --fake-redis --rps 50 --duration 30 --output results.json
+    python benchmarks/run.py --fake-redis --rps 50 --duration 30 --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = {
+    "task": "/api/v1/{provider}/task/{name}",
+    "router": "/api/v1/{provider}/router/{name}",
+    "task_batch": "/api/v1/{provider}/task/{name}/batch",
+    "router_batch": "/api/v1/{provider}/router/{name}/batch",
+    "task_stream": "/api/v1/{provider}/task/{name}/stream",
+    "router_stream": "/api/v1/{provider}/router/{name}/stream",
+}
+CACHE_METRIC = re.compile(r'^llm_server_cache_lookups_total\{(?P<labels>[^}]*)\} (?P<value>\S+)$')
+
+
+def process_usage(pid: int) -> Tuple[Optional[float], Optional[int]]:
+    """CPU seconds and resident memory of a process, via psutil when installed, else /proc."""
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        times = process.cpu_times()
+        return times.user + times.system, process.memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f"/proc/{pid}/statm") as statm:
+            rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+    except (OSError, ValueError):
+        return None, None
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    samples = np.asarray(values) * 1000
+    return {
+        "mean": round(float(samples.mean()), 3),
+        "p50": round(float(np.percentile(samples, 50)), 3),
+        "p90": round(float(np.percentile(samples, 90)), 3),
+        "p95": round(float(np.percentile(samples, 95)), 3),
+        "p99": round(float(np.percentile(samples, 99)), 3),
+        "max": round(float(samples.max()), 3),
+    }
+
+
+def cache_counters(metrics_text: str) -> Dict[str, Dict[str, float]]:
+    counters: Dict[str, Dict[str, float]] = defaultdict(lambda: {"hit": 0.0, "miss": 0.0})
+    for line in metrics_text.splitlines():
+        match = CACHE_METRIC.match(line)
+        if match:
+            labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group("labels")))
+            counters[labels["layer"]][labels["result"]] += float(match.group("value"))
+    return counters
+
+
+def ensure_port_free(port: int):
+    with socket.socket() as probe:
+        if probe.connect_ex(("127.0.0.1", port)) == 0:
+            sys.exit(f"Port {port} is already in use; stop whatever is listening or pick another port")
+
+
+def start_fake_redis(port: int) -> str:
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        sys.exit("--fake-redis needs the fakeredis package (pip install fakeredis)")
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}"
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                sys.exit(f"Process exited early while waiting for {url}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    sys.exit(f"Timed out waiting for {url}")
+
+
+async def send(client: httpx.AsyncClient, entry: Dict[str, Any]) -> Dict[str, Any]:
+    endpoint = entry["endpoint"]
+    path = PATHS[endpoint].format(provider=entry["provider"], name=entry["name"])
+    started = time.perf_counter()
+    first_byte = None
+    try:
+        async with client.stream("POST", path, json=entry["body"]) as response:
+            async for _ in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {
+        "endpoint": endpoint,
+        "status": status,
+        "latency": time.perf_counter() - started,
+        "ttfb": first_byte,
+    }
+
+
+async def generate_load(base_url: str, entries: List[Dict[str, Any]], args: argparse.Namespace) -> Tuple[List[Dict[str, Any]], float]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        total = args.requests or int(args.rps * args.duration)
+        started = loop.time()
+        pending = []
+        for index in range(total):
+            await asyncio.sleep(max(0.0, started + index / args.rps - loop.time()))
+            pending.append(asyncio.create_task(send(client, entries[index % len(entries)])))
+        results = await asyncio.gather(*pending)
+        return results, loop.time() - started
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    by_endpoint: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for result in results:
+        by_endpoint[result["endpoint"]].append(result)
+    status_codes: Dict[str, int] = defaultdict(int)
+    for result in results:
+        status_codes[str(result["status"])] += 1
+    ok = [result for result in results if result["status"] == 200]
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "duration_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": percentiles([result["latency"] for result in ok]),
+        "status_codes": dict(status_codes),
+        "by_endpoint": {
+            endpoint: {
+                "requests": len(items),
+                "errors": sum(item["status"] != 200 for item in items),
+                "latency_ms": percentiles([item["latency"] for item in items if item["status"] == 200]),
+                "ttfb_ms": percentiles([item["ttfb"] for item in items if item["status"] == 200 and item["ttfb"]]),
+            }
+            for endpoint, items in by_endpoint.items()
+        },
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """Relative change of headline metrics against a previous run (positive means larger)."""
+    def change(path: List[str]) -> Optional[float]:
+        new, old = current, baseline
+        for key in path:
+            new = (new or {}).get(key)
+            old = (old or {}).get(key)
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or not old:
+            return None
+        return round((new - old) / old, 4)
+
+    metrics = {
+        "throughput_rps": ["throughput_rps"],
+        "latency_p50_ms": ["latency_ms", "p50"],
+        "latency_p99_ms": ["latency_ms", "p99"],
+        "cpu_ms_per_request": ["server", "cpu_ms_per_request"],
+        "rss_bytes_end": ["server", "rss_bytes_end"],
+    }
+    return {name: change(path) for name, path in metrics.items()}
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    with open(args.traffic) as traffic:
+        entries = [json.loads(line) for line in traffic if line.strip()]
+    unknown = {entry["endpoint"] for entry in entries} - set(PATHS)
+    if unknown:
+        sys.exit(f"Unknown endpoints in traffic file: {sorted(unknown)}")
+
+    for port in (args.port, args.openai_port) + ((args.fake_redis_port,) if args.fake_redis else ()):
+        ensure_port_free(port)
+    redis_url = start_fake_redis(args.fake_redis_port) if args.fake_redis else args.redis_url
+    fake_openai = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai.py"),
+        "--port", str(args.openai_port),
+        "--latency-ms", str(args.latency_ms),
+        "--embedding-latency-ms", str(args.embedding_latency_ms),
+        "--string-words", str(args.string_words),
+        "--error-rate", str(args.error_rate),
+    ])
+    openai_url = f"http://127.0.0.1:{args.openai_port}"
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "REDIS_URL": redis_url,
+        "HOST": "127.0.0.1",
+        "PORT": str(args.port),
+    }
+    env.pop("LOGFIRE_TOKEN", None)
+    env.update(dict(item.split("=", 1) for item in args.server_env))
+    server_log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env, stdout=server_log, stderr=server_log)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        await wait_until_ready(f"{openai_url}/stats", fake_openai)
+        await wait_until_ready(f"{base_url}/metrics", server)
+        async with httpx.AsyncClient() as client:
+            if args.flush_redis and not args.fake_redis:
+                import redis
+                redis.Redis.from_url(redis_url).flushdb()
+            metrics_before = (await client.get(f"{base_url}/metrics")).text
+            upstream_before = (await client.get(f"{openai_url}/stats")).json()
+            cpu_before, rss_before = process_usage(server.pid)
+
+            results, elapsed = await generate_load(base_url, entries, args)
+
+            cpu_after, rss_after = process_usage(server.pid)
+            metrics_after = (await client.get(f"{base_url}/metrics")).text
+            upstream_after = (await client.get(f"{openai_url}/stats")).json()
+    finally:
+        server.terminate()
+        fake_openai.terminate()
+        server.wait()
+        fake_openai.wait()
+
+    report = summarize(results, elapsed)
+    before, after = cache_counters(metrics_before), cache_counters(metrics_after)
+    report["cache"] = {}
+    for layer, counts in after.items():
+        hits = counts["hit"] - before.get(layer, {}).get("hit", 0.0)
+        misses = counts["miss"] - before.get(layer, {}).get("miss", 0.0)
+        report["cache"][layer] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None else None
+    report["server"] = {
+        "cpu_seconds": round(cpu_seconds, 3) if cpu_seconds is not None else None,
+        "cpu_ms_per_request": round(cpu_seconds * 1000 / len(results), 3) if cpu_seconds is not None and results else None,
+        "rss_bytes_start": rss_before,
+        "rss_bytes_end": rss_after,
+        "rss_bytes_per_request": (rss_after - rss_before) / len(results) if rss_before is not None and results else None,
+    }
+    report["upstream"] = {key: upstream_after[key] - upstream_before.get(key, 0) for key in upstream_after}
+    report["config"] = {
+        key: value for key, value in vars(args).items() if key not in ("output", "baseline", "server_log")
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["comparison"] = compare(report, json.load(baseline))
+    return report
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traffic", default=os.path.join(ROOT, "benchmarks", "traffic.jsonl"))
+    parser.add_argument("--rps", type=float, default=20, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load to offer")
+    parser.add_argument("--requests", type=int, help="Send exactly this many requests instead of rps * duration")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=8011, help="Port for the server under test")
+    parser.add_argument("--openai-port", type=int, default=8099)
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--flush-redis", action="store_true", help="FLUSHDB the Redis at --redis-url before the run")
+    parser.add_argument("--fake-redis", action="store_true", help="Serve Redis from an in-process fakeredis server")
+    parser.add_argument("--fake-redis-port", type=int, default=6399)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Fake completion latency")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50, help="Fake embedding latency")
+    parser.add_argument("--string-words", type=int, default=40, help="Words per generated string field")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream calls answered with 429")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the server, e.g. LOCAL_CACHE_ENABLED=false")
+    parser.add_argument("--server-log", help="Write server output to this file")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = asyncio.run(main(arguments))
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(result, output, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
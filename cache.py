@@ -1,62 +1,569 @@
 import os
-import json
+import zlib
 import hashlib
 import logging
 from functools import wraps
 from redis import asyncio as aioredis
+import time
 import asyncio
+import contextvars
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import orjson
 import logfire
+from deadlines import Deadline, DeadlineExceeded, current_deadline, remaining, set_deadline
+from embeddings import from_base64, to_base64
+from metrics import (
+    observe_stage, record_cache_lookup, record_cache_writes, record_local_cache_evictions, set_cache_write_queue,
+    set_local_cache_size
+)
+
+try:
+    import zstandard
+except ImportError:  # Optional; values are compressed with zlib when it is not installed
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 CACHE_EXPIRATION = 6 * 30 * 24 * 60 * 60 # 6 month
 CACHE_PREFIX = "llm_server:"
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+LOCAL_CACHE_ENABLED = os.getenv("LOCAL_CACHE_ENABLED", "true").lower() == "true"
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "1024"))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Upper bound on how long a process serves an entry from memory, so purges reach every worker
+LOCAL_CACHE_TTL = int(os.getenv("LOCAL_CACHE_TTL", "60"))
+SINGLE_FLIGHT_REDIS_LOCK = os.getenv("SINGLE_FLIGHT_REDIS_LOCK", "false").lower() == "true"
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", "60"))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.1"))
+# "zstd", "zlib" or "none"; values below the minimum size are stored uncompressed
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd" if zstandard else "zlib").lower()
+CACHE_COMPRESSION_MIN_BYTES = int(os.getenv("CACHE_COMPRESSION_MIN_BYTES", "256"))
+CACHE_WRITE_QUEUE_SIZE = int(os.getenv("CACHE_WRITE_QUEUE_SIZE", "1000"))
+CACHE_WRITE_BATCH_SIZE = int(os.getenv("CACHE_WRITE_BATCH_SIZE", "100"))
 
-# Add Logfire configuration
-logfire.configure(
-    token=os.getenv("LOGFIRE_TOKEN"),
-    send_to_logfire="if-token-present",
-    scrubbing=False
-)
+# Values start with this byte and a codec byte; it never begins JSON text, so entries written
+# as plain JSON before compression was added still read back
+FORMAT_MARKER = 0xFF
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD = b"n", b"z", b"s"
+_CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+if CACHE_COMPRESSION not in _CODECS or (CACHE_COMPRESSION == "zstd" and zstandard is None):
+    raise ValueError(f"Unsupported CACHE_COMPRESSION: {CACHE_COMPRESSION}")
+_zstd_compressor = zstandard.ZstdCompressor() if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+# Deletes a single-flight lock only while it still holds our token, so a holder whose lock
+# expired mid-computation cannot release the lock a peer has taken since
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _encode_array(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        # Packed float32 instead of a JSON float list
+        return {"__f32__": to_base64(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_arrays(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "__f32__" in value:
+            return from_base64(value["__f32__"])
+        return {key: _decode_arrays(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_arrays(item) for item in value]
+    return value
+
+
+def _encode(result: Any) -> Tuple[bytes, int]:
+    """The stored bytes and the uncompressed size, which is what a decoded value costs in memory."""
+    raw = orjson.dumps(result, default=_encode_array)
+    codec = _CODECS[CACHE_COMPRESSION] if len(raw) >= CACHE_COMPRESSION_MIN_BYTES else CODEC_NONE
+    if codec == CODEC_ZSTD:
+        payload = _zstd_compressor.compress(raw)
+    elif codec == CODEC_ZLIB:
+        payload = zlib.compress(raw)
+    else:
+        payload = raw
+    return bytes((FORMAT_MARKER,)) + codec + payload, len(raw)
+
+
+def _decode(data: bytes) -> Tuple[Any, int]:
+    if data[0] != FORMAT_MARKER:
+        raw = data
+    else:
+        codec, payload = data[1:2], data[2:]
+        if codec == CODEC_ZSTD:
+            if _zstd_decompressor is None:
+                raise ValueError("Cache value is zstd-compressed but zstandard is not installed")
+            raw = _zstd_decompressor.decompress(payload)
+        elif codec == CODEC_ZLIB:
+            raw = zlib.decompress(payload)
+        elif codec == CODEC_NONE:
+            raw = payload
+        else:
+            raise ValueError(f"Unknown cache value codec: {codec!r}")
+    return _decode_arrays(orjson.loads(raw)), len(raw)
+
+
+def serialize(result: Any) -> bytes:
+    return _encode(result)[0]
+
+
+def deserialize(data: bytes) -> Any:
+    return _decode(data)[0]
+
+
+class RedisPool:
+    """Process-wide Redis connection pool, opened and closed by the application lifespan."""
+
+    _pool: Optional[aioredis.BlockingConnectionPool] = None
+    _client: Optional[aioredis.Redis] = None
+
+    @classmethod
+    def connect(cls) -> aioredis.Redis:
+        if cls._client is None:
+            cls._pool = aioredis.BlockingConnectionPool.from_url(
+                REDIS_URL,
+                # Cache values are binary; the few string reads decode themselves
+                encoding="utf8",
+                decode_responses=False,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                timeout=REDIS_POOL_TIMEOUT,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            )
+            cls._client = aioredis.Redis(connection_pool=cls._pool)
+            logger.info(f"Redis pool created (max_connections={REDIS_MAX_CONNECTIONS})")
+        return cls._client
+
+    @classmethod
+    def get_client(cls) -> aioredis.Redis:
+        # Falls back to a lazily created pool when used outside the application lifespan
+        return cls._client or cls.connect()
+
+    @classmethod
+    async def disconnect(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            await cls._pool.disconnect()
+            cls._client = None
+            cls._pool = None
+            logger.info("Redis pool closed")
+
+
+class LocalCache:
+    """Size- and byte-bounded in-process LRU with per-entry TTL, consulted before Redis.
+
+    Entries live at most ttl seconds, however long they stay in Redis: deletes only reach this
+    process's copy, so other processes keep serving theirs until it expires.
+
+    Its size and evictions are exported to Prometheus; hits and misses are counted by the callers
+    as llm_server_cache_lookups_total{layer="local"}.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, expire: int):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + min(expire, self.ttl), size, value)
+        self._bytes += size
+        evictions = 0
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            evictions += 1
+        if evictions:
+            record_local_cache_evictions(evictions)
+        set_local_cache_size(len(self._entries), self._bytes)
+
+    def delete(self, key: str):
+        if key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        set_local_cache_size(len(self._entries), self._bytes)
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TTL)
+
+
+class PartialResult(Exception):
+    """Raised by a computation cancelled after it produced something worth caching, e.g. a
+    completion whose embedding was still running; compute_and_cache stores it and stays cancelled."""
+
+    def __init__(self, result: Any):
+        super().__init__("Computation cancelled with a partial result")
+        self.result = result
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one in-flight task per process.
+
+    The call runs under the latest deadline of the callers waiting on it, pushed back as later
+    callers join, and each caller waits only until its own deadline. A caller that is cancelled or
+    times out leaves the call running for the others; once every caller has gone, the call is
+    cancelled too.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._deadlines: Dict[asyncio.Task, Deadline] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        timeout = remaining()
+        task = self._calls.get(key)
+        if task is None:
+            # Started in a copy of the context with its own deadline, so callers who join later can
+            # extend it without touching the first caller's
+            deadline = Deadline(current_deadline())
+            context = contextvars.copy_context()
+            context.run(set_deadline, deadline)
+            task = context.run(asyncio.ensure_future, fn())
+            self._calls[key] = task
+            self._deadlines[task] = deadline
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            logfire.info("Single-flight join", extra={"cache_key": key})
+            self._deadlines[task].extend(current_deadline())
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # Shielded so a disconnecting caller does not cancel the call for the others
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError) as error:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            if isinstance(error, asyncio.TimeoutError):
+                raise DeadlineExceeded("Request deadline exceeded") from None
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        self._deadlines.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter went away
+
+    def in_flight(self) -> int:
+        return len(self._calls)
 
-def redis_cache(expire=CACHE_EXPIRATION):
+
+single_flight = SingleFlight()
+
+
+class CacheWriter:
+    """Write-behind queue for Redis cache writes.
+
+    Misses return as soon as the result exists while a background task pipelines the SETEXs in
+    batches. The queue is bounded, so a slow Redis makes writers wait rather than grow memory, and
+    values still queued are served to readers in this process.
+    """
+
+    def __init__(self, max_pending: int, batch_size: int):
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, bytes] = {}
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Flush what is queued so a clean shutdown loses no writes
+        await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+
+    def pending(self, key: str) -> Optional[bytes]:
+        return self._pending.get(key)
+
+    async def put(self, key: str, data: bytes, expire: int):
+        if self._task is None:
+            # Outside the application lifespan there is no flusher, so write inline
+            await RedisPool.get_client().setex(key, expire, data)
+            return
+        self._pending[key] = data
+        await self._queue.put((key, data, expire))
+        set_cache_write_queue(self._queue.qsize())
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                async with RedisPool.get_client().pipeline(transaction=False) as pipe:
+                    for key, data, expire in batch:
+                        pipe.setex(key, expire, data)
+                    await pipe.execute()
+                record_cache_writes("written", len(batch))
+            except Exception as e:
+                record_cache_writes("failed", len(batch))
+                logger.error(f"Failed to write {len(batch)} cache entries: {str(e)}")
+            finally:
+                for key, data, _ in batch:
+                    if self._pending.get(key) is data:
+                        del self._pending[key]
+                    self._queue.task_done()
+                set_cache_write_queue(self._queue.qsize())
+
+
+cache_writer = CacheWriter(CACHE_WRITE_QUEUE_SIZE, CACHE_WRITE_BATCH_SIZE)
+
+
+async def _read_cached(redis: aioredis.Redis, cache_key: str, expire: int, local: bool) -> Tuple[Optional[Any], int]:
+    """The cached value and its stored size in bytes, or (None, 0)."""
+    cached_result = cache_writer.pending(cache_key) or await redis.get(cache_key)
+    if not cached_result:
+        return None, 0
+    parsed_result, raw_size = _decode(cached_result)
+    if local:
+        local_cache.set(cache_key, parsed_result, raw_size, expire)
+    return parsed_result, len(cached_result)
+
+
+async def _wait_for_peer(redis: aioredis.Redis, cache_key: str, lock_key: str, expire: int, local: bool) -> Optional[Any]:
+    """Poll for a result another process is computing under the lock; None if it never shows up."""
+    deadline = time.monotonic() + SINGLE_FLIGHT_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        result, _ = await _read_cached(redis, cache_key, expire, local)
+        if result is not None:
+            return result
+        if not await redis.exists(lock_key):
+            break
+    return (await _read_cached(redis, cache_key, expire, local))[0]
+
+
+async def get_cached(
+    cache_key: str, expire=CACHE_EXPIRATION, local=LOCAL_CACHE_ENABLED, labels: Tuple[Any, Any] = (None, None)
+) -> Optional[Any]:
+    started = time.perf_counter()
+    with observe_stage("cache_lookup", *labels):
+        # Serve hot keys from process memory before going to Redis
+        if local:
+            local_result = local_cache.get(cache_key)
+            record_cache_lookup("local", local_result is not None, *labels)
+            if local_result is not None:
+                logfire.info("Local cache hit", extra={"cache_key": cache_key})
+                return local_result
+
+        parsed_result, size = await _read_cached(RedisPool.get_client(), cache_key, expire, local)
+        record_cache_lookup("redis", parsed_result is not None, *labels)
+    if parsed_result is not None:
+        logfire.info("Cache hit", extra={
+            "cache_key": cache_key,
+            "size": size,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        })
+    return parsed_result
+
+
+async def store_result(
+    cache_key: str,
+    result: Any,
+    expire=CACHE_EXPIRATION,
+    local=LOCAL_CACHE_ENABLED,
+    labels: Tuple[Any, Any] = (None, None),
+    wait: bool = False,
+):
+    """Cache a result; the Redis write is queued unless wait is set, e.g. when another process is
+    about to read it back."""
+    started = time.perf_counter()
+    with observe_stage("cache_write", *labels):
+        serialized, raw_size = _encode(result)
+        if local:
+            local_cache.set(cache_key, result, raw_size, expire)
+        if wait:
+            await RedisPool.get_client().setex(cache_key, expire, serialized)
+        else:
+            await cache_writer.put(cache_key, serialized, expire)
+    logfire.info("Cache miss", extra={
+        "cache_key": cache_key,
+        "size": len(serialized),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+
+
+def hash_request(request: Any) -> str:
+    # orjson sorts keys much faster than json.dumps, and blake2b outpaces md5 on larger bodies
+    return hashlib.blake2b(orjson.dumps(request, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+def make_cache_key(name: str, params: Dict[str, Any]) -> str:
+    # Generate a more readable cache key
+    key_parts = [name]
+    for k, v in params.items():
+        if k == 'request':
+            # Hash the request body
+            key_parts.append(f"{k}:{hash_request(v)}")
+        else:
+            key_parts.append(f"{k}:{getattr(v, 'value', v)}")
+    return f"{CACHE_PREFIX}{':'.join(key_parts)}"
+
+
+async def find_keys(prefix: str) -> List[str]:
+    """All cached result keys under a prefix, skipping single-flight lock keys."""
+    redis = RedisPool.get_client()
+    keys = [key.decode() async for key in redis.scan_iter(match=f"{prefix}*", count=1000)]
+    return [key for key in keys if not key.endswith(":lock")]
+
+
+async def delete_keys(keys: List[str], chunk_size: int = 500) -> int:
+    """Delete keys from Redis and this process's local cache; other processes' local copies
+    expire within LOCAL_CACHE_TTL."""
+    redis = RedisPool.get_client()
+    deleted = 0
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        deleted += await redis.unlink(*chunk)
+        for key in chunk:
+            local_cache.delete(key)
+    return deleted
+
+
+async def get_many(
+    keys: List[str], expire=CACHE_EXPIRATION, local=LOCAL_CACHE_ENABLED, labels: Tuple[Any, Any] = (None, None)
+) -> List[Optional[Any]]:
+    """Look up several keys at once: local cache first, then a single MGET for the rest."""
+    with observe_stage("cache_lookup", *labels):
+        results = [local_cache.get(key) if local else None for key in keys]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if local:
+            for result in results:
+                record_cache_lookup("local", result is not None, *labels)
+        if missing:
+            redis = RedisPool.get_client()
+            values = await redis.mget([keys[index] for index in missing])
+            for index, value in zip(missing, values):
+                value = cache_writer.pending(keys[index]) or value
+                record_cache_lookup("redis", bool(value), *labels)
+                if value:
+                    results[index], raw_size = _decode(value)
+                    if local:
+                        local_cache.set(keys[index], results[index], raw_size, expire)
+    logfire.info("Cache batch lookup", extra={
+        "keys": len(keys),
+        "hits": sum(result is not None for result in results)
+    })
+    return results
+
+
+async def compute_and_cache(
+    cache_key: str,
+    fn: Callable[[], Awaitable[Any]],
+    expire=CACHE_EXPIRATION,
+    local=LOCAL_CACHE_ENABLED,
+    lock=SINGLE_FLIGHT_REDIS_LOCK,
+    labels: Tuple[Any, Any] = (None, None),
+    wait: bool = False,
+) -> Any:
+    """Compute a missed key once (per process, and optionally across processes) and store it.
+
+    With wait set the Redis write completes before returning instead of going through the
+    write-behind queue.
+    """
+    redis = RedisPool.get_client()
+
+    async def compute():
+        lock_key = f"{cache_key}:lock"
+        lock_token = uuid.uuid4().hex
+        acquired = False
+        if lock:
+            acquired = await redis.set(lock_key, lock_token, nx=True, px=int(SINGLE_FLIGHT_LOCK_TIMEOUT * 1000))
+            if not acquired:
+                peer_result = await _wait_for_peer(redis, cache_key, lock_key, expire, local)
+                if peer_result is not None:
+                    logfire.info("Cache hit after peer computation", extra={"cache_key": cache_key})
+                    return peer_result
+        try:
+            # If not cached, call the function
+            try:
+                result = await fn()
+            except PartialResult as partial:
+                await store_result(cache_key, partial.result, expire=expire, local=local, labels=labels)
+                raise asyncio.CancelledError()
+
+            # Peers polling under the lock read Redis as soon as it is released, so skip the queue then
+            await store_result(cache_key, result, expire=expire, local=local, labels=labels, wait=wait or acquired)
+            return result
+        finally:
+            if acquired:
+                await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, lock_token)
+
+    # Identical requests already in flight in this process share one upstream call
+    return await single_flight.do(cache_key, compute)
+
+
+def redis_cache(
+    expire=CACHE_EXPIRATION,
+    local=LOCAL_CACHE_ENABLED,
+    lock=SINGLE_FLIGHT_REDIS_LOCK,
+    name=None,
+    key: Optional[Callable[..., str]] = None,
+):
+    """Cache an async function's result by its keyword arguments, or by key(**kwargs) when given."""
     def decorator(func):
+        key_name = name or func.__name__
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            async with aioredis.from_url(REDIS_URL, encoding="utf8", decode_responses=True) as redis:
-                # Generate a more readable cache key
-                key_parts = [func.__name__]
-                for k, v in kwargs.items():
-                    if k == 'request':
-                        # Hash the request body
-                        request_hash = hashlib.md5(json.dumps(v, sort_keys=True).encode()).hexdigest()
-                        key_parts.append(f"{k}:{request_hash}")
-                    else:
-                        key_parts.append(f"{k}:{v}")
-                
-                cache_key = f"{CACHE_PREFIX}{':'.join(key_parts)}"
-
-                # Try to get the cached result
-                cached_result = await redis.get(cache_key)
-                if cached_result:
-                    parsed_result = json.loads(cached_result)
-                    logfire.info("Cache hit", extra={
-                        "cache_key": cache_key,
-                        "cached_result": parsed_result
-                    })
-                    return parsed_result
-
-                # If not cached, call the function
-                result = await func(*args, **kwargs)
-
-                # Cache the result
-                await asyncio.create_task(redis.setex(cache_key, expire, json.dumps(result)))
-                logfire.info("Cache miss", extra={
-                    "cache_key": cache_key,
-                    "new_result": result
-                })
+            cache_key = key(**kwargs) if key else make_cache_key(key_name, kwargs)
+            labels = (kwargs.get("provider"), kwargs.get("task_name") or kwargs.get("router_name"))
 
-            return result
+            # Try to get the cached result
+            cached_result = await get_cached(cache_key, expire=expire, local=local, labels=labels)
+            if cached_result is not None:
+                return cached_result
+
+            return await compute_and_cache(
+                cache_key, lambda: func(*args, **kwargs), expire=expire, local=local, lock=lock, labels=labels
+            )
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -1,4 +1,5 @@
 import os
+import json
 from enum import Enum
 
 class Provider(str, Enum):
@@ -6,4 +7,54 @@ class Provider(str, Enum):
     MODERATION = "moderation"
 
 class Config:
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
\ No newline at end of file
+    HOST = os.getenv("HOST", "0.0.0.0")
+    PORT = int(os.getenv("PORT", "8011"))
+    # Server processes; above 1 the app is loaded once and forked into that many workers
+    WORKERS = int(os.getenv("WORKERS", "1"))
+    # Seconds a stopping worker waits for in-flight requests, jobs and deferred embeddings
+    GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    # Required in the X-Admin-Token header by the admin endpoints, which are disabled when unset
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+    OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() == "true"
+    OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    # Default deadline in seconds for task and router requests, unset for none; X-Request-Timeout can shorten it
+    REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "0")) or None
+    # Send a second, identical completion when the first is slower than this quantile of recent calls
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.25"))
+    BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "256"))
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    # Map-reduce tasks split content above this many (estimated) tokens and summarize the chunks in parallel
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "6000"))
+    CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+    EMBEDDING_BATCH_ENABLED = os.getenv("EMBEDDING_BATCH_ENABLED", "true").lower() == "true"
+    EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+    EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "64"))
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    COMPLETION_MODEL = os.getenv("COMPLETION_MODEL", "gpt-4o-2024-08-06")
+    # Per task/router name, e.g. {"content_moderation_router": {"cascade_model": "gpt-4o-mini-2024-07-18"}}
+    MODEL_OVERRIDES = json.loads(os.getenv("MODEL_OVERRIDES", "{}"))
+    SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    SCHEDULER_DEFAULT_RPM = int(os.getenv("SCHEDULER_DEFAULT_RPM", "5000"))
+    SCHEDULER_DEFAULT_TPM = int(os.getenv("SCHEDULER_DEFAULT_TPM", "800000"))
+    # Per-model overrides, e.g. {"gpt-4o-2024-08-06": {"rpm": 5000, "tpm": 800000}}
+    OPENAI_RATE_LIMITS = json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}"))
+    SCHEDULER_MAX_QUEUE_DEPTH = int(os.getenv("SCHEDULER_MAX_QUEUE_DEPTH", "500"))
+    SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+    SCHEDULER_COMPLETION_TOKENS = int(os.getenv("SCHEDULER_COMPLETION_TOKENS", "500"))
+    SCHEDULER_DEFAULT_PRIORITY = 10
+    # Lower values are admitted first when calls queue up, e.g. "moderation=0,summarization=1"
+    PROVIDER_PRIORITIES = {
+        Provider(name.strip()): int(priority)
+        for name, priority in (
+            item.split("=") for item in os.getenv("PROVIDER_PRIORITIES", "moderation=0,summarization=1").split(",") if item
+        )
+    }
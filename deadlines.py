@@ -0,0 +1,55 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+
+class Deadline:
+    """Monotonic time by which work must finish, None for none.
+
+    Held by reference, so work shared by several requests (see SingleFlight) can be given the
+    latest of their deadlines after it started, including in tasks it has already spawned.
+    """
+
+    __slots__ = ("at",)
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+
+    def extend(self, at: Optional[float]):
+        """Push the deadline back to at if that is later; None removes it."""
+        if self.at is not None:
+            self.at = None if at is None else max(self.at, at)
+
+
+# The current request's deadline; tasks started from it inherit it
+_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline has passed before an upstream call could start."""
+
+
+def set_timeout(timeout: Optional[float]):
+    """Give the current context a deadline timeout seconds from now; None removes it."""
+    set_deadline(Deadline(time.monotonic() + timeout) if timeout is not None else None)
+
+
+def set_deadline(deadline: Optional[Deadline]):
+    _deadline.set(deadline)
+
+
+def current_deadline() -> Optional[float]:
+    """The monotonic time of the current deadline, or None without one."""
+    deadline = _deadline.get()
+    return deadline.at if deadline is not None else None
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline, or None without one."""
+    deadline = current_deadline()
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left
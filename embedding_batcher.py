@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import weakref
+from typing import List, Optional, Set, Tuple
+import numpy as np
+from openai import AsyncOpenAI
+import logfire
+from embeddings import from_base64
+from deadlines import set_timeout
+from scheduler import UpstreamScheduler, estimate_tokens
+from metrics import record_usage
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Collects embedding requests from concurrent callers and sends them as one embeddings.create call.
+
+    A batch is flushed when the window elapses, when it reaches max_batch_size inputs, or
+    when adding another input would exceed max_tokens.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        model: str,
+        window: float,
+        max_batch_size: int,
+        max_tokens: int,
+        dimensions: Optional[int] = None,
+    ):
+        # Weak, so OpenAIClient's batchers, cached per client, do not keep their client alive
+        self._client = weakref.ref(client)
+        self.model = model
+        self.dimensions = dimensions
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_tokens = max_tokens
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._pending_tokens = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Batches being sent; the loop only keeps weak references to tasks
+        self._sending: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tokens = estimate_tokens(text)
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+        self._pending.append((text, future))
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if batch:
+            send = asyncio.ensure_future(self._send(batch))
+            self._sending.add(send)
+            send.add_done_callback(self._send_done)
+
+    def _send_done(self, send: asyncio.Task):
+        self._sending.discard(send)
+        if not send.cancelled() and send.exception() is not None:
+            logger.error("Embedding batch failed", exc_info=send.exception())
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        # The batch serves many requests, so none of their deadlines applies to it
+        set_timeout(None)
+        texts = [text for text, _ in batch]
+        try:
+            client = self._client()
+            if client is None:
+                raise RuntimeError("The embedding client was garbage collected before the batch was sent")
+            params = {"dimensions": self.dimensions} if self.dimensions else {}
+            async with UpstreamScheduler.slot(
+                self.model, sum(estimate_tokens(text) for text in texts)
+            ) as reservation:
+                response = await client.embeddings.create(
+                    model=self.model,
+                    input=texts,
+                    encoding_format="base64",
+                    **params,
+                )
+                if reservation is not None:
+                    reservation.record_usage(response.usage)
+            record_usage(response.usage, self.model)
+        except asyncio.CancelledError:
+            # Waiters would otherwise never hear back
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        logfire.info("Embedding batch sent", extra={"model": self.model, "size": len(batch)})
+        for item in response.data:
+            future = batch[item.index][1]
+            if not future.done():
+                future.set_result(from_base64(item.embedding))
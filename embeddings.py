@@ -0,0 +1,50 @@
+import base64
+from enum import Enum
+from typing import Any, Dict, Union, List
+import numpy as np
+import orjson
+
+# Embeddings are kept as little-endian float32 throughout the server
+EMBEDDING_DTYPE = np.dtype("<f4")
+EMBEDDING_FIELDS = ("action_embedding", "router_embedding")
+
+
+class EmbeddingFormat(str, Enum):
+    FLOAT = "float"
+    BASE64 = "base64"
+
+
+class EmbeddingMode(str, Enum):
+    # Computed before the response is returned
+    INLINE = "inline"
+    # Returned as null and computed after the response, then written to the cache entry
+    DEFERRED = "deferred"
+    SKIP = "skip"
+
+
+def from_base64(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=EMBEDDING_DTYPE)
+
+
+def to_base64(vector: Union[np.ndarray, List[float]]) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()).decode("ascii")
+
+
+def encode_output(output: Dict[str, Any], embedding_format: EmbeddingFormat = EmbeddingFormat.FLOAT) -> Dict[str, Any]:
+    """Render the embedding fields of a task/router output for an HTTP response.
+
+    Float embeddings stay numpy arrays; dumps() writes them out without a Python list in between.
+    """
+    encoded = dict(output)
+    for field in EMBEDDING_FIELDS:
+        vector = encoded.get(field)
+        if vector is None:
+            continue
+        if embedding_format == EmbeddingFormat.BASE64:
+            encoded[field] = to_base64(vector)
+    return encoded
+
+
+def dumps(data: Any) -> bytes:
+    """JSON bytes of a response body, including any numpy embeddings in it."""
+    return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
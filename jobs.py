@@ -0,0 +1,411 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import ipaddress
+import logging
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlparse
+import httpx
+import orjson
+import logfire
+from fastapi import HTTPException
+from config import Provider
+from cache import RedisPool, CACHE_PREFIX, get_cached, compute_and_cache
+from embeddings import EmbeddingFormat, encode_output, dumps
+from openai_client import OpenAIClient
+from api_handler import APIHandler
+from base import ProviderTaskRegistry, ProviderRouterRegistry
+
+logger = logging.getLogger(__name__)
+
+# "redis" shares the queue between processes; "memory" keeps jobs in this process only
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "redis").lower()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL = int(os.getenv("JOB_TTL", str(24 * 60 * 60)))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+JOB_CALLBACK_ATTEMPTS = int(os.getenv("JOB_CALLBACK_ATTEMPTS", "3"))
+# Comma-separated hosts callbacks may be sent to, whatever they resolve to; when empty, callbacks
+# may go to any host that resolves only to public addresses
+JOB_CALLBACK_ALLOWED_HOSTS = [host for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host]
+JOB_PREFIX = f"{CACHE_PREFIX}job:"
+JOB_QUEUE_KEY = f"{CACHE_PREFIX}jobs:queue"
+# Each worker moves the ids it takes into its own list and removes them once the job is settled,
+# so a crash or shutdown between taking a job and finishing it does not lose the id
+JOB_PROCESSING_PREFIX = f"{CACHE_PREFIX}jobs:processing:"
+# Refreshed while a process's workers run; processing lists of processes without one are requeued
+JOB_CONSUMER_PREFIX = f"{CACHE_PREFIX}jobs:consumer:"
+JOB_CONSUMER_TTL = 30
+# Saturation and rate limits are retried after Retry-After instead of failing the job
+RETRYABLE_STATUS = (429, 503)
+
+
+class JobQueue:
+    """Runs task and router requests in background workers so clients need not hold a connection.
+
+    A job record holds the request and the cache key its result is stored under; finished jobs
+    read their result back from the cache rather than keeping a copy.
+    """
+
+    _workers: List[asyncio.Task] = []
+    # Workers in the middle of a job, which stop() lets finish
+    _busy: Set[asyncio.Task] = set()
+    # Callbacks for jobs that completed on submit; kept referenced until sent, and awaited by stop()
+    _notifications: Set[asyncio.Task] = set()
+    _stopping = False
+    # Identifies this process's processing lists; set on start, so each forked worker has its own
+    _consumer: Optional[str] = None
+    _heartbeat: Optional[asyncio.Task] = None
+    _memory_queue: Optional[asyncio.Queue] = None
+    _memory_jobs: Dict[str, Dict[str, Any]] = {}
+    _http: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def start(cls, workers: int = JOB_WORKERS):
+        if cls._workers:
+            return
+        cls._stopping = False
+        cls._memory_queue = asyncio.Queue()
+        cls._http = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT)
+        cls._consumer = uuid.uuid4().hex
+        cls._workers = [asyncio.create_task(cls._worker(number)) for number in range(workers)]
+        if JOB_QUEUE_BACKEND != "memory":
+            cls._heartbeat = asyncio.create_task(cls._keep_alive())
+        logger.info(f"Started {workers} job workers ({JOB_QUEUE_BACKEND} queue)")
+
+    @classmethod
+    async def stop(cls, timeout: float = 0):
+        """Stop taking jobs, give running ones up to timeout to finish, then cancel (and requeue) the rest."""
+        cls._stopping = True
+        deadline = time.monotonic() + timeout
+        for worker in cls._workers:
+            if worker not in cls._busy:
+                worker.cancel()
+        if cls._busy and timeout > 0:
+            await asyncio.wait(set(cls._busy), timeout=timeout)
+        for worker in cls._workers:
+            worker.cancel()
+        await asyncio.gather(*cls._workers, return_exceptions=True)
+        if cls._heartbeat is not None:
+            cls._heartbeat.cancel()
+            await asyncio.gather(cls._heartbeat, return_exceptions=True)
+            cls._heartbeat = None
+            # Ids taken but not started (e.g. cancelled right after the move) go back to the queue
+            try:
+                for number in range(len(cls._workers)):
+                    await cls._requeue_all(cls._processing_key(number))
+                await RedisPool.get_client().delete(f"{JOB_CONSUMER_PREFIX}{cls._consumer}")
+            except Exception as e:
+                # Left for the next process to start, which requeues them once the consumer key expires
+                logger.error(f"Could not requeue taken jobs: {str(e)}")
+        cls._workers = []
+        if cls._notifications:
+            await asyncio.wait(set(cls._notifications), timeout=max(deadline - time.monotonic(), 0.1))
+            for notification in cls._notifications:
+                notification.cancel()
+        if cls._http is not None:
+            await cls._http.aclose()
+            cls._http = None
+        logger.info("Job workers stopped")
+
+    @staticmethod
+    async def validate_callback_url(callback_url: Optional[str]):
+        if callback_url is None:
+            return
+        parsed = urlparse(callback_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise HTTPException(status_code=400, detail="callback_url must be an absolute http(s) URL")
+        if JOB_CALLBACK_ALLOWED_HOSTS:
+            if parsed.hostname not in JOB_CALLBACK_ALLOWED_HOSTS:
+                raise HTTPException(status_code=400, detail=f"Callbacks to {parsed.hostname} are not allowed")
+            return
+        # Otherwise keep callbacks away from loopback, private networks and cloud metadata endpoints
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                parsed.hostname, parsed.port or 443, type=socket.SOCK_STREAM
+            )
+        except (socket.gaierror, UnicodeError):
+            raise HTTPException(status_code=400, detail=f"Cannot resolve callback host {parsed.hostname}")
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                raise HTTPException(status_code=400, detail=f"Callbacks to {parsed.hostname} are not allowed")
+
+    @classmethod
+    async def submit(
+        cls,
+        kind: str,
+        provider: Provider,
+        name: str,
+        request: Dict[str, Any],
+        cache_key: str,
+        callback_url: Optional[str] = None,
+        embedding_format: EmbeddingFormat = EmbeddingFormat.FLOAT,
+    ) -> Dict[str, Any]:
+        await cls.validate_callback_url(callback_url)
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "provider": provider.value,
+            "name": name,
+            "request": request,
+            "cache_key": cache_key,
+            "callback_url": callback_url,
+            "embedding_format": embedding_format.value,
+            "status": "queued",
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        # Already cached results complete immediately without queueing
+        if await get_cached(cache_key, labels=(provider, name)) is not None:
+            job["status"] = "succeeded"
+            await cls._save(job)
+            # The callback can take several slow attempts; the 202 should not wait for them
+            notification = asyncio.ensure_future(cls._notify(job))
+            cls._notifications.add(notification)
+            notification.add_done_callback(cls._notification_done)
+        else:
+            await cls._save(job)
+            await cls._push(job["id"])
+        logfire.info("Job submitted", extra={"job_id": job["id"], "status": job["status"], "name": name})
+        return cls.view(job)
+
+    @classmethod
+    async def get(cls, job_id: str, embedding_format: Optional[EmbeddingFormat] = None) -> Optional[Dict[str, Any]]:
+        job = await cls._load(job_id)
+        if job is None:
+            return None
+        return await cls.result_view(job, embedding_format)
+
+    @staticmethod
+    def view(job: Dict[str, Any]) -> Dict[str, Any]:
+        fields = ("id", "kind", "provider", "name", "status", "attempts", "created_at", "updated_at", "error")
+        return {field: job[field] for field in fields if field in job}
+
+    @classmethod
+    async def result_view(cls, job: Dict[str, Any], embedding_format: Optional[EmbeddingFormat] = None) -> Dict[str, Any]:
+        view = cls.view(job)
+        if job["status"] == "succeeded":
+            result = await get_cached(job["cache_key"], labels=(job["provider"], job["name"]))
+            if result is None:
+                view["status"] = "expired"
+            else:
+                result = await cls._with_embedding(job, result)
+                view["result"] = encode_output(result, embedding_format or EmbeddingFormat(job["embedding_format"]))
+        return view
+
+    @staticmethod
+    async def _with_embedding(job: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """The result with its embedding handled by the task's or router's embedding_mode, as the
+        synchronous endpoints do for entries cached without one."""
+        provider = Provider(job["provider"])
+        if job["kind"] == "task":
+            handler_class = ProviderTaskRegistry.get_task(provider, job["name"])
+        else:
+            handler_class = ProviderRouterRegistry.get_router(provider, job["name"])
+        try:
+            return await APIHandler.apply_embedding_mode(
+                handler_class, OpenAIClient.get_client(), lambda: job["cache_key"], result, handler_class.embedding_mode
+            )
+        except Exception as e:
+            # The result is still useful; its embedding can be fetched from the .../embedding endpoint
+            logger.warning(f"Could not add the embedding to job {job['id']}: {str(e)}")
+            return result
+
+    @staticmethod
+    def _processing_key(number: int) -> str:
+        return f"{JOB_PROCESSING_PREFIX}{JobQueue._consumer}:{number}"
+
+    @classmethod
+    async def _keep_alive(cls):
+        """Refresh this process's consumer key, after requeueing the jobs of processes that died."""
+        redis = RedisPool.get_client()
+        recovered = False
+        while True:
+            try:
+                await redis.setex(f"{JOB_CONSUMER_PREFIX}{cls._consumer}", JOB_CONSUMER_TTL, b"1")
+                if not recovered:
+                    await cls._recover()
+                    recovered = True
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {str(e)}")
+            await asyncio.sleep(JOB_CONSUMER_TTL / 3)
+
+    @classmethod
+    async def _recover(cls):
+        redis = RedisPool.get_client()
+        async for key in redis.scan_iter(match=f"{JOB_PROCESSING_PREFIX}*"):
+            consumer = key.decode()[len(JOB_PROCESSING_PREFIX):].split(":")[0]
+            if await redis.exists(f"{JOB_CONSUMER_PREFIX}{consumer}"):
+                continue
+            requeued = await cls._requeue_all(key)
+            if requeued:
+                logger.warning(f"Requeued {requeued} jobs left by a stopped process")
+
+    @staticmethod
+    async def _requeue_all(processing_key) -> int:
+        redis = RedisPool.get_client()
+        requeued = 0
+        while await redis.lmove(processing_key, JOB_QUEUE_KEY, "LEFT", "RIGHT"):
+            requeued += 1
+        return requeued
+
+    @classmethod
+    async def _worker(cls, number: int):
+        worker = asyncio.current_task()
+        processing_key = cls._processing_key(number)
+        while not cls._stopping:
+            try:
+                job_id = await cls._pop(processing_key)
+                if job_id is None:
+                    continue
+                # Busy from the moment the id leaves the queue, so stop() does not strand it
+                cls._busy.add(worker)
+                try:
+                    job = await cls._load(job_id)
+                    if job is not None and job["status"] in ("queued", "running"):
+                        await cls._run(job, processing_key)
+                    else:
+                        await cls._ack(processing_key, job_id)
+                finally:
+                    cls._busy.discard(worker)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}", exc_info=True)
+                await asyncio.sleep(1)
+
+    @classmethod
+    async def _run(cls, job: Dict[str, Any], processing_key: str):
+        provider, name = Provider(job["provider"]), job["name"]
+        handler = APIHandler.process_task if job["kind"] == "task" else APIHandler.process_router
+        client = OpenAIClient.get_client()
+        try:
+            while True:
+                job["status"] = "running"
+                job["attempts"] += 1
+                await cls._save(job)
+                try:
+                    # Written through so a poll served by another process finds the result
+                    await compute_and_cache(
+                        job["cache_key"],
+                        lambda: handler(provider, name, client, job["request"]),
+                        labels=(provider, name),
+                        wait=True,
+                    )
+                    job["status"] = "succeeded"
+                    break
+                except HTTPException as e:
+                    if e.status_code in RETRYABLE_STATUS and job["attempts"] < JOB_MAX_ATTEMPTS:
+                        await asyncio.sleep(float((e.headers or {}).get("Retry-After", "1")))
+                        continue
+                    job["status"] = "failed"
+                    job["error"] = {"status_code": e.status_code, "detail": e.detail}
+                    break
+                except Exception as e:
+                    logger.error(f"Job {job['id']} failed: {str(e)}", exc_info=True)
+                    job["status"] = "failed"
+                    job["error"] = {"status_code": 500, "detail": "An unexpected error occurred."}
+                    break
+        except asyncio.CancelledError:
+            # Shutting down mid-job: hand it back to the queue for another worker or process
+            job["status"] = "queued"
+            await cls._save(job)
+            await cls._requeue(processing_key, job["id"])
+            raise
+        await cls._save(job)
+        await cls._ack(processing_key, job["id"])
+        logfire.info("Job finished", extra={"job_id": job["id"], "status": job["status"], "attempts": job["attempts"]})
+        await cls._notify(job)
+
+    @classmethod
+    def _notification_done(cls, notification: asyncio.Task):
+        cls._notifications.discard(notification)
+        if not notification.cancelled() and notification.exception() is not None:
+            logger.error("Job callback failed", exc_info=notification.exception())
+
+    @classmethod
+    async def _notify(cls, job: Dict[str, Any]):
+        if not job.get("callback_url"):
+            return
+        try:
+            # Checked again, since the host may resolve differently than it did on submit
+            await cls.validate_callback_url(job["callback_url"])
+        except HTTPException as e:
+            logger.warning(f"Not sending callback for job {job['id']}: {e.detail}")
+            return
+        payload = dumps(await cls.result_view(job))
+        for attempt in range(JOB_CALLBACK_ATTEMPTS):
+            try:
+                response = await cls._http.post(
+                    job["callback_url"], content=payload, headers={"Content-Type": "application/json"}
+                )
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError as e:
+                logger.warning(f"Callback for job {job['id']} failed: {str(e)}")
+            await asyncio.sleep(2 ** attempt)
+        logger.error(f"Giving up on callback for job {job['id']} after {JOB_CALLBACK_ATTEMPTS} attempts")
+
+    @classmethod
+    async def _save(cls, job: Dict[str, Any]):
+        job["updated_at"] = time.time()
+        if JOB_QUEUE_BACKEND == "memory":
+            cls._memory_jobs[job["id"]] = job
+            cls._prune_memory()
+            return
+        await RedisPool.get_client().setex(f"{JOB_PREFIX}{job['id']}", JOB_TTL, orjson.dumps(job))
+
+    @classmethod
+    def _prune_memory(cls):
+        # Jobs stay in creation order, so expired ones are at the front
+        expired_before = time.time() - JOB_TTL
+        while cls._memory_jobs:
+            job_id, job = next(iter(cls._memory_jobs.items()))
+            if job["created_at"] >= expired_before or job["status"] in ("queued", "running"):
+                break
+            del cls._memory_jobs[job_id]
+
+    @classmethod
+    async def _load(cls, job_id: str) -> Optional[Dict[str, Any]]:
+        if JOB_QUEUE_BACKEND == "memory":
+            return cls._memory_jobs.get(job_id)
+        data = await RedisPool.get_client().get(f"{JOB_PREFIX}{job_id}")
+        return orjson.loads(data) if data else None
+
+    @classmethod
+    async def _push(cls, job_id: str):
+        if JOB_QUEUE_BACKEND == "memory":
+            cls._memory_queue.put_nowait(job_id)
+            return
+        await RedisPool.get_client().rpush(JOB_QUEUE_KEY, job_id)
+
+    @classmethod
+    async def _pop(cls, processing_key: str) -> Optional[str]:
+        if JOB_QUEUE_BACKEND == "memory":
+            return await cls._memory_queue.get()
+        # Short timeout keeps the pooled connection from being held indefinitely
+        item = await RedisPool.get_client().blmove(JOB_QUEUE_KEY, processing_key, timeout=1)
+        return item.decode() if item else None
+
+    @classmethod
+    async def _ack(cls, processing_key: str, job_id: str):
+        if JOB_QUEUE_BACKEND == "memory":
+            return
+        await RedisPool.get_client().lrem(processing_key, 1, job_id)
+
+    @classmethod
+    async def _requeue(cls, processing_key: str, job_id: str):
+        if JOB_QUEUE_BACKEND == "memory":
+            cls._memory_queue.put_nowait(job_id)
+            return
+        async with RedisPool.get_client().pipeline(transaction=True) as pipe:
+            pipe.lrem(processing_key, 1, job_id)
+            pipe.rpush(JOB_QUEUE_KEY, job_id)
+            await pipe.execute()
@@ -1,24 +1,130 @@
 import importlib
+import json
+import logging
 import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+from config import Provider
 
-def load_tasks():
-    task_dir = os.path.join(os.path.dirname(__file__), 'tasks')
-    for provider in os.listdir(task_dir):
-        provider_dir = os.path.join(task_dir, provider)
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Maps provider and task/router name to the module that registers it; regenerate with
+# `python loaders.py` after adding, renaming or moving a task or router
+MANIFEST_PATH = os.path.join(ROOT, "registry_manifest.json")
+
+# Seconds spent on each startup step and module import, in the order they happened
+startup_times: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(label: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_times[label] = startup_times.get(label, 0.0) + time.perf_counter() - started
+
+
+def import_module(module_name: str):
+    """importlib.import_module, recording how long the first import took."""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with timed(module_name):
+        module = importlib.import_module(module_name)
+    logger.info(f"Imported {module_name} in {startup_times[module_name] * 1000:.1f} ms")
+    return module
+
+
+def discover_modules(package: str) -> List[str]:
+    package_dir = os.path.join(ROOT, package)
+    modules = []
+    for provider in sorted(os.listdir(package_dir)):
+        provider_dir = os.path.join(package_dir, provider)
         if os.path.isdir(provider_dir):
-            for task_file in os.listdir(provider_dir):
-                if task_file.endswith('.py'):
-                    module_name = f"tasks.{provider}.{task_file[:-3]}"
-                    importlib.import_module(module_name)
-                    
-                    
+            for file_name in sorted(os.listdir(provider_dir)):
+                if file_name.endswith('.py'):
+                    modules.append(f"{package}.{provider}.{file_name[:-3]}")
+    return modules
+
+
+def read_manifest() -> Dict[str, Dict[str, Dict[str, str]]]:
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def _load(package: str, registry):
+    """Register the manifest's names with registry and import only modules the manifest lacks."""
+    discovered = discover_modules(package)
+    manifest = read_manifest().get(package)
+    complete = manifest is not None
+    if not complete:
+        logger.warning(f"No {os.path.basename(MANIFEST_PATH)}; importing every module in {package}/")
+        manifest = {}
+    listed = set()
+    for provider, names in manifest.items():
+        for name, module_name in names.items():
+            if module_name not in discovered:
+                logger.warning(f"{module_name} is in the manifest but does not exist; skipping {name}")
+                continue
+            registry.add_module(Provider(provider), name, module_name)
+            listed.add(module_name)
+    for module_name in discovered:
+        if module_name not in listed:
+            if complete:
+                logger.warning(f"{module_name} is not in the manifest; run `python loaders.py` to add it")
+            import_module(module_name)
+
+
+def load_tasks():
+    from base import ProviderTaskRegistry
+
+    with timed("load tasks"):
+        _load("tasks", ProviderTaskRegistry)
+
 
 def load_routers():
-    router_dir = os.path.join(os.path.dirname(__file__), 'routers')
-    for provider in os.listdir(router_dir):
-        provider_dir = os.path.join(router_dir, provider)
-        if os.path.isdir(provider_dir):
-            for router_file in os.listdir(provider_dir):
-                if router_file.endswith('.py'):
-                    module_name = f"routers.{provider}.{router_file[:-3]}"
-                    importlib.import_module(module_name)
\ No newline at end of file
+    from base import ProviderRouterRegistry
+
+    with timed("load routers"):
+        _load("routers", ProviderRouterRegistry)
+
+
+def write_manifest():
+    """Import every task and router module and record which names each one registered."""
+    from base import ProviderTaskRegistry, ProviderRouterRegistry
+
+    for package in ("tasks", "routers"):
+        for module_name in discover_modules(package):
+            importlib.import_module(module_name)
+    manifest = {
+        package: {
+            provider.value: {name: registered.__module__ for name, registered in classes.items()}
+            for provider, classes in registry._providers.items()
+            if classes
+        }
+        for package, registry in (("tasks", ProviderTaskRegistry), ("routers", ProviderRouterRegistry))
+    }
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return manifest
+
+
+def log_startup_report(total: float):
+    """Log the total startup time and what it was spent on, slowest first."""
+    lines = [f"Startup took {total * 1000:.1f} ms"]
+    for label, seconds in sorted(startup_times.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {label}: {seconds * 1000:.1f} ms")
+    logger.info("\n".join(lines))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    written = write_manifest()
+    count = sum(len(names) for providers in written.values() for names in providers.values())
+    logger.info(f"Wrote {count} entries to {MANIFEST_PATH}")
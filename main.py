@@ -1,11 +1,22 @@
-from application import Application
-from loaders import load_tasks, load_routers
-from base import ProviderTaskRegistry, ProviderRouterRegistry
+import time
+
+started = time.perf_counter()
+
+from loaders import import_module, load_tasks, load_routers, log_startup_report, timed
+
+# Imported one by one first so the startup report shows what each dependency costs;
+# `python -X importtime main.py` has the full per-module breakdown
+for module_name in ("numpy", "pydantic", "fastapi", "openai", "redis", "logfire", "prometheus_client"):
+    import_module(module_name)
+
+with timed("server modules"):
+    from application import Application
 
 if __name__ == "__main__":
+    # Tasks and routers listed in registry_manifest.json are imported on first use
     load_tasks()
     load_routers()
-    print(ProviderTaskRegistry._providers)  # Debug print
-    print(ProviderRouterRegistry._providers)  # Debug print
-    app = Application()
-    app.run()
\ No newline at end of file
+    with timed("app setup"):
+        app = Application()
+    log_startup_report(time.perf_counter() - started)
+    app.run()
@@ -0,0 +1,172 @@
+import asyncio
+import re
+import zlib
+from functools import lru_cache
+from typing import Any, AsyncIterator, ClassVar, Dict, List, Optional, Tuple, Type
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+from base import BaseTask
+from cache import get_many, compute_and_cache, hash_request, make_cache_key
+from config import Config
+from metrics import observe_stage, record_map_chunk
+from openai_client import OpenAIClient
+from scheduler import estimate_tokens
+from template_renderer import TemplateRenderer
+
+# A paragraph whose checksum hits this divisor may end a chunk once it is past half the budget
+BOUNDARY_DIVISOR = 4
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _pieces(text: str, max_tokens: int) -> List[str]:
+    """Paragraphs, with any paragraph over the budget broken into sentences or, failing that, slices."""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            step = max_tokens * 4
+            pieces.extend(sentence[start:start + step] for start in range(0, len(sentence), step))
+    return pieces
+
+
+def split_content(text: str, max_tokens: int) -> List[str]:
+    """Split text into chunks of at most max_tokens (estimated) along paragraph boundaries.
+
+    Boundaries depend on the paragraphs themselves rather than on absolute offsets, so an edit
+    only changes the chunks around it and the rest keep hitting the per-chunk cache.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for piece in _pieces(text, max_tokens):
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+        if current_tokens >= max_tokens // 2 and zlib.crc32(piece.encode()) % BOUNDARY_DIVISOR == 0:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+@lru_cache(maxsize=None)
+def map_version(task_class: Type["MapReduceTask"]) -> str:
+    # Only what shapes a chunk summary, so reduce-side edits keep chunk results
+    return hash_request({
+        "template": task_class.map_template,
+        "schema": task_class.map_output_schema.model_json_schema(),
+        "models": task_class.models(),
+    })[:12]
+
+
+class MapReduceTask(BaseTask):
+    """A task whose chunk_field is summarized piecewise when it exceeds chunk_max_tokens.
+
+    Each chunk is rendered with map_template (the chunk as `chunk`, plus the other input fields)
+    into map_output_schema, in parallel and cached per chunk. The chunk results are then rendered
+    with reduce_template (as `chunk_summaries`) into output_schema; when they are themselves too
+    large, they are first mapped again in groups until they fit.
+    """
+    map_template: ClassVar[str]
+    reduce_template: ClassVar[str]
+    map_output_schema: ClassVar[Type[BaseModel]]
+    chunk_field: ClassVar[str] = "content"
+    chunk_max_tokens: ClassVar[int] = Config.CHUNK_MAX_TOKENS
+
+    @classmethod
+    def templates(cls) -> Dict[str, str]:
+        return {'prompt': cls.prompt_template, 'map': cls.map_template, 'reduce': cls.reduce_template}
+
+    @classmethod
+    def needs_chunking(cls, input_data: Dict[str, Any]) -> bool:
+        content = input_data.get(cls.chunk_field)
+        return isinstance(content, str) and estimate_tokens(content) > cls.chunk_max_tokens
+
+    @classmethod
+    async def process(
+        cls, client: AsyncOpenAI, input_data: Dict[str, Any], embed: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        if not cls.needs_chunking(input_data):
+            return await super().process(client, input_data, embed)
+        with observe_stage("validation", cls.provider, cls.name):
+            variables = cls.input_schema(**input_data).model_dump()
+        content = variables.pop(cls.chunk_field)
+
+        chunks = split_content(content, cls.chunk_max_tokens)
+        summaries = await cls.map_chunks(client, chunks, variables)
+        # Hierarchical reduce: regroup partial summaries until they fit in one prompt
+        while len(summaries) > 1 and estimate_tokens(cls.join_summaries(summaries)) > cls.chunk_max_tokens:
+            groups = split_content(
+                "\n\n".join(cls.join_summaries([summary]) for summary in summaries), cls.chunk_max_tokens
+            )
+            if len(groups) >= len(summaries):
+                break
+            summaries = await cls.map_chunks(client, groups, variables)
+
+        with observe_stage("render", cls.provider, cls.name):
+            prompt = TemplateRenderer.render(cls.reduce_template, chunk_summaries=summaries, **variables)
+        with observe_stage("reduce", cls.provider, cls.name):
+            response_output = await OpenAIClient.completion(
+                client, prompt, cls.output_schema, cls.provider, cls.name, cls.models(), cls.confidence_check
+            )
+        return await cls.build_output(client, response_output.model_dump(), None, embed)
+
+    @classmethod
+    async def stream(cls, client: AsyncOpenAI, input_data: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        if not cls.needs_chunking(input_data):
+            async for event in super().stream(client, input_data):
+                yield event
+            return
+        # Only the reduce pass produces the final structure, so there is nothing useful to stream
+        output = await cls.process(client, input_data)
+        yield "output", output
+
+    @classmethod
+    async def map_chunks(
+        cls, client: AsyncOpenAI, chunks: List[str], variables: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        labels = (cls.provider, cls.name)
+        keys = [
+            make_cache_key("map_chunk", {
+                "provider": cls.provider,
+                "task_name": cls.name,
+                "version": map_version(cls),
+                "request": {**variables, "chunk": chunk},
+            })
+            for chunk in chunks
+        ]
+        cached = await get_many(keys, labels=labels)
+        semaphore = asyncio.Semaphore(Config.CHUNK_CONCURRENCY)
+
+        async def summarize(chunk: str) -> Dict[str, Any]:
+            async with semaphore:
+                prompt = TemplateRenderer.render(cls.map_template, chunk=chunk, **variables)
+                with observe_stage("map", cls.provider, cls.name):
+                    response_output = await OpenAIClient.completion(
+                        client, prompt, cls.map_output_schema, cls.provider, cls.name, cls.models()
+                    )
+                return response_output.model_dump()
+
+        async def map_chunk(key: str, chunk: str, cached_summary: Any) -> Dict[str, Any]:
+            record_map_chunk(cached_summary is not None, *labels)
+            if cached_summary is not None:
+                return cached_summary
+            return await compute_and_cache(key, lambda: summarize(chunk), labels=labels)
+
+        return await asyncio.gather(*(
+            map_chunk(key, chunk, cached_summary)
+            for key, chunk, cached_summary in zip(keys, chunks, cached)
+        ))
+
+    @classmethod
+    def join_summaries(cls, summaries: List[Dict[str, Any]]) -> str:
+        return "\n\n".join(
+            "\n".join(f"{field}: {value}" for field, value in summary.items()) for summary in summaries
+        )
@@ -0,0 +1,131 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+from prometheus_client import Counter, Gauge, Histogram
+
+# Upper bounds from sub-millisecond cache reads to multi-second completions
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram(
+    "llm_server_request_seconds",
+    "End-to-end HTTP request latency",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "llm_server_stage_seconds",
+    "Latency of each stage of task and router processing",
+    ["stage", "provider", "name"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS = Counter(
+    "llm_server_tokens_total",
+    "Tokens reported in the OpenAI usage field",
+    ["provider", "name", "model", "kind"],
+)
+CACHE_LOOKUPS = Counter(
+    "llm_server_cache_lookups_total",
+    "Cache lookups by layer and outcome",
+    ["layer", "result", "provider", "name"],
+)
+MAP_CHUNKS = Counter(
+    "llm_server_map_chunks_total",
+    "Chunks of map-reduce tasks, by whether the chunk summary was cached or computed",
+    ["provider", "name", "result"],
+)
+CASCADE_ATTEMPTS = Counter(
+    "llm_server_cascade_attempts_total",
+    "Model cascade attempts by outcome; invalid and low_confidence attempts escalate to the next model",
+    ["provider", "name", "model", "outcome"],
+)
+CACHE_WRITES = Counter(
+    "llm_server_cache_writes_total",
+    "Redis cache writes flushed from the write-behind queue, by outcome",
+    ["result"],
+)
+CACHE_WRITE_QUEUE = Gauge(
+    "llm_server_cache_write_queue",
+    "Cache writes waiting in the write-behind queue",
+)
+HEDGED_CALLS = Counter(
+    "llm_server_hedged_calls_total",
+    "Completions that were hedged with a second call, by which call answered first",
+    ["model", "winner"],
+)
+LOCAL_CACHE_EVICTIONS = Counter(
+    "llm_server_local_cache_evictions_total",
+    "Entries evicted from the in-process cache to stay within its entry and byte limits",
+)
+LOCAL_CACHE_SIZE = Gauge(
+    "llm_server_local_cache_size",
+    "Entries and bytes held by the in-process cache",
+    ["unit"],
+)
+CACHE_HIT_RATIO = Gauge(
+    "llm_server_cache_hit_ratio",
+    "Hit ratio of each cache layer since process start",
+    ["layer"],
+)
+
+_cache_totals: Dict[str, Tuple[int, int]] = {}
+
+
+def labels_for(provider, name: Optional[str]) -> Tuple[str, str]:
+    provider = getattr(provider, "value", provider)
+    return str(provider or ""), name or ""
+
+
+@contextmanager
+def observe_stage(stage: str, provider=None, name: Optional[str] = None) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage, *labels_for(provider, name)).observe(time.perf_counter() - started)
+
+
+def record_cache_lookup(layer: str, hit: bool, provider=None, name: Optional[str] = None):
+    CACHE_LOOKUPS.labels(layer, "hit" if hit else "miss", *labels_for(provider, name)).inc()
+    hits, total = _cache_totals.get(layer, (0, 0))
+    hits, total = hits + hit, total + 1
+    _cache_totals[layer] = (hits, total)
+    CACHE_HIT_RATIO.labels(layer).set(hits / total)
+
+
+def record_cache_writes(result: str, count: int):
+    CACHE_WRITES.labels(result).inc(count)
+
+
+def set_cache_write_queue(size: int):
+    CACHE_WRITE_QUEUE.set(size)
+
+
+def record_local_cache_evictions(count: int):
+    LOCAL_CACHE_EVICTIONS.inc(count)
+
+
+def set_local_cache_size(entries: int, size: int):
+    LOCAL_CACHE_SIZE.labels("entries").set(entries)
+    LOCAL_CACHE_SIZE.labels("bytes").set(size)
+
+
+def record_map_chunk(cached: bool, provider=None, name: Optional[str] = None):
+    MAP_CHUNKS.labels(*labels_for(provider, name), "cached" if cached else "computed").inc()
+
+
+def record_cascade_attempt(outcome: str, model: str, provider=None, name: Optional[str] = None):
+    CASCADE_ATTEMPTS.labels(*labels_for(provider, name), model, outcome).inc()
+
+
+def record_hedge(model: str, winner: str):
+    HEDGED_CALLS.labels(model, winner).inc()
+
+
+def record_usage(usage, model: str, provider=None, name: Optional[str] = None):
+    if usage is None:
+        return
+    provider_label, name_label = labels_for(provider, name)
+    TOKENS.labels(provider_label, name_label, model, "prompt").inc(usage.prompt_tokens)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if completion_tokens:
+        TOKENS.labels(provider_label, name_label, model, "completion").inc(completion_tokens)
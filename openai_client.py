@@ -1,39 +1,266 @@
-import os
-from openai import AsyncOpenAI
+import time
+import asyncio
+import weakref
+from collections import deque
+import httpx
+import numpy as np
+from openai import AsyncOpenAI, APITimeoutError, LengthFinishReasonError, ContentFilterFinishReasonError
 from pydantic import BaseModel
-from typing import Type, List
-from config import Config
+from typing import Type, Dict, Optional, List, Any, AsyncIterator, Awaitable, Callable, Deque, TypeVar, Union
+from config import Config, Provider
+from deadlines import current_deadline, remaining
+from embedding_batcher import EmbeddingBatcher
+from embeddings import from_base64
+from scheduler import UpstreamScheduler, estimate_tokens
+from metrics import record_usage, record_cascade_attempt, record_hedge
 import logfire  # Add this import
 
+COMPLETION_MODEL = Config.COMPLETION_MODEL
+EMBEDDING_MODEL = "text-embedding-3-large"
+# Completion latencies kept per model for the hedge delay
+LATENCY_WINDOW = 200
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Recent completion latencies per model."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, model: str, seconds: float):
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, model: str, q: float) -> Optional[float]:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < Config.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+completion_latency = LatencyTracker(LATENCY_WINDOW)
+
 
 class OpenAIClient:
+    _client: Optional[AsyncOpenAI] = None
+    # Keyed weakly by client, and their values hold no strong reference back to it
+    _embedding_batchers: "weakref.WeakKeyDictionary[AsyncOpenAI, Dict[Optional[int], EmbeddingBatcher]]" = (
+        weakref.WeakKeyDictionary()
+    )
+    _no_retry_clients: "weakref.WeakKeyDictionary[AsyncOpenAI, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def startup(cls) -> AsyncOpenAI:
+        """Build the shared client and its keep-alive HTTP pool once per process."""
+        if cls._client is None:
+            http_client = httpx.AsyncClient(
+                http2=Config.OPENAI_HTTP2,
+                timeout=Config.OPENAI_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=Config.OPENAI_KEEPALIVE_EXPIRY,
+                ),
+            )
+            cls._client = AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                base_url=Config.OPENAI_BASE_URL,
+                http_client=http_client,
+                max_retries=Config.OPENAI_MAX_RETRIES,
+            )
+            logfire.instrument_openai(cls._client)  # Instrument the OpenAI client
+        return cls._client
+
+    @classmethod
+    def get_client(cls) -> AsyncOpenAI:
+        return cls._client or cls.startup()
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._client is not None:
+            await cls._client.close()
+            cls._client = None
+        cls._embedding_batchers.clear()
+        cls._no_retry_clients.clear()
+
     @staticmethod
-    def get_client():
-        client = AsyncOpenAI(api_key=Config.OPENAI_API_KEY)
-        logfire.configure(
-            token=os.getenv("LOGFIRE_TOKEN"),  # Set the token
-            send_to_logfire="if-token-present",  # Only send if token is present
-        )  # Configure Logfire
-        logfire.instrument_openai(client)  # Instrument the OpenAI client
-        return client
+    def completion_messages(prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": "You are a helpful AI assistant."},
+            {"role": "user", "content": prompt},
+        ]
 
     @staticmethod
-    async def completion(
-        client: AsyncOpenAI, prompt: str, response_format: Type[BaseModel]
+    def router_messages(
+        instructions: str, context: str, format_instructions: str, prompt: str
+    ) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": "You are a helpful AI assistant."},
+            {"role": "system", "content": instructions},
+            {"role": "system", "content": context},
+            {"role": "system", "content": format_instructions},
+            {"role": "user", "content": prompt},
+        ]
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        return prompt_tokens + Config.SCHEDULER_COMPLETION_TOKENS
+
+    @staticmethod
+    def request_options() -> Dict[str, Any]:
+        """Per-call options bounding the HTTP timeout by what is left of the request's deadline."""
+        left = remaining()
+        return {"timeout": min(left, Config.OPENAI_TIMEOUT)} if left is not None else {}
+
+    @classmethod
+    def request_client(cls, client: AsyncOpenAI) -> AsyncOpenAI:
+        """client, or a copy of it that does not retry when the request has a deadline.
+
+        The SDK's retries start after their own backoff and would spend quota past the deadline.
+        """
+        if remaining() is None:
+            return client
+        no_retry = cls._no_retry_clients.get(client)
+        if no_retry is None:
+            no_retry = client.with_options(max_retries=0)
+            logfire.instrument_openai(no_retry)
+            cls._no_retry_clients[client] = no_retry
+        return no_retry
+
+    @classmethod
+    async def bounded(cls, client: AsyncOpenAI, call: Callable[[AsyncOpenAI, Dict[str, Any]], Awaitable[T]]) -> T:
+        """Await call(client, options) under the request's deadline, see request_client and
+        request_options. A call that timed out on a deadline that has been pushed back meanwhile
+        (by a request joining shared work, see SingleFlight) is made again under the new one."""
+        while True:
+            deadline = current_deadline()
+            try:
+                return await call(cls.request_client(client), cls.request_options())
+            except APITimeoutError:
+                if deadline is None or current_deadline() == deadline:
+                    raise
+
+    @staticmethod
+    async def hedged(call: Callable[[], Awaitable[T]], model: str) -> T:
+        """Await call(), starting a second identical call once the first is slower than the
+        HEDGE_QUANTILE of recent latencies, and return whichever succeeds first."""
+        delay = completion_latency.quantile(model, Config.HEDGE_QUANTILE) if Config.HEDGE_ENABLED else None
+        if delay is None:
+            return await call()
+        delay = max(delay, Config.HEDGE_MIN_DELAY)
+        started = {}
+        primary = asyncio.ensure_future(call())
+        started[primary] = time.perf_counter()
+        hedge = None
+        winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            hedge = asyncio.ensure_future(call())
+            started[hedge] = time.perf_counter()
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        record_hedge(model, "primary" if task is primary else "hedge")
+                        return task.result()
+            record_hedge(model, "failed")
+            return primary.result()
+        finally:
+            # The slower call is cancelled, so it stops before it uses any more quota. Its time so far
+            # still goes into the latency window, or the window would only hold winners and the
+            # quantile would keep dropping
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    if winner is not None:
+                        completion_latency.record(model, max(time.perf_counter() - started[task], delay))
+                    task.cancel()
+
+    @staticmethod
+    async def parse(
+        client: AsyncOpenAI,
+        messages: List[Dict[str, str]],
+        response_format: Type[BaseModel],
+        provider: Optional[Provider] = None,
+        name: Optional[str] = None,
+        model: str = COMPLETION_MODEL,
     ) -> BaseModel:
-        response = await client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant."},
-                {"role": "user", "content": prompt},
-            ],
-            response_format=response_format,
-        )
+        async def call():
+            async with UpstreamScheduler.slot(
+                model, OpenAIClient.estimate_tokens(messages), provider
+            ) as reservation:
+                started = time.perf_counter()
+                response = await OpenAIClient.bounded(
+                    client,
+                    lambda bounded_client, options: bounded_client.beta.chat.completions.parse(
+                        model=model,
+                        messages=messages,
+                        response_format=response_format,
+                        **options,
+                    )
+                )
+                completion_latency.record(model, time.perf_counter() - started)
+                if reservation is not None:
+                    reservation.record_usage(response.usage)
+            record_usage(response.usage, model, provider, name)
+            return response
+
+        response = await OpenAIClient.hedged(call, model)
         parsed_response = response.choices[0].message.parsed
         if parsed_response is None:
             raise ValueError("Failed to parse response")
         return parsed_response
 
+    @staticmethod
+    async def cascade_parse(
+        client: AsyncOpenAI,
+        messages: List[Dict[str, str]],
+        response_format: Type[BaseModel],
+        provider: Optional[Provider] = None,
+        name: Optional[str] = None,
+        models: Optional[List[str]] = None,
+        accept: Optional[Callable[[BaseModel], bool]] = None,
+    ) -> BaseModel:
+        """Try each model in order, escalating to the next when the output does not parse and
+        validate or accept() rejects it. The last model's answer is returned as is."""
+        models = models or [COMPLETION_MODEL]
+        for model in models[:-1]:
+            try:
+                parsed_response = await OpenAIClient.parse(client, messages, response_format, provider, name, model)
+            except (ValueError, LengthFinishReasonError, ContentFilterFinishReasonError):
+                record_cascade_attempt("invalid", model, provider, name)
+                continue
+            if accept is not None and not accept(parsed_response):
+                record_cascade_attempt("low_confidence", model, provider, name)
+                continue
+            record_cascade_attempt("accepted", model, provider, name)
+            return parsed_response
+        parsed_response = await OpenAIClient.parse(client, messages, response_format, provider, name, models[-1])
+        if len(models) > 1:
+            record_cascade_attempt("accepted", models[-1], provider, name)
+        return parsed_response
+
+    @staticmethod
+    async def completion(
+        client: AsyncOpenAI,
+        prompt: str,
+        response_format: Type[BaseModel],
+        provider: Optional[Provider] = None,
+        name: Optional[str] = None,
+        models: Optional[List[str]] = None,
+        accept: Optional[Callable[[BaseModel], bool]] = None,
+    ) -> BaseModel:
+        return await OpenAIClient.cascade_parse(
+            client, OpenAIClient.completion_messages(prompt), response_format, provider, name, models, accept
+        )
+
     @staticmethod
     async def router_call(
         client: AsyncOpenAI,
@@ -42,26 +269,81 @@ class OpenAIClient:
         format_instructions: str,
         prompt: str,
         response_format: Type[BaseModel],
+        provider: Optional[Provider] = None,
+        name: Optional[str] = None,
+        models: Optional[List[str]] = None,
+        accept: Optional[Callable[[BaseModel], bool]] = None,
     ) -> BaseModel:
-        response = await client.beta.chat.completions.parse(
-            model="gpt-4o-2024-08-06",
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant."},
-                {"role": "system", "content": instructions},
-                {"role": "system", "content": context},
-                {"role": "system", "content": format_instructions},
-                {"role": "user", "content": prompt},
-            ],
-            response_format=response_format,
+        return await OpenAIClient.cascade_parse(
+            client,
+            OpenAIClient.router_messages(instructions, context, format_instructions, prompt),
+            response_format,
+            provider,
+            name,
+            models,
+            accept,
         )
+
+    @staticmethod
+    async def stream_parse(
+        client: AsyncOpenAI,
+        messages: List[Dict[str, str]],
+        response_format: Type[BaseModel],
+        provider: Optional[Provider] = None,
+        name: Optional[str] = None,
+        model: str = COMPLETION_MODEL,
+    ) -> AsyncIterator[Union[Dict[str, Any], BaseModel]]:
+        """Yield partially parsed output dicts as tokens arrive, then the validated model last."""
+        async with UpstreamScheduler.slot(
+            model, OpenAIClient.estimate_tokens(messages), provider
+        ) as reservation:
+            async with OpenAIClient.request_client(client).beta.chat.completions.stream(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                stream_options={"include_usage": True},
+                **OpenAIClient.request_options(),
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content.delta" and event.parsed is not None:
+                        yield event.parsed
+                response = await stream.get_final_completion()
+            if reservation is not None:
+                reservation.record_usage(response.usage)
+        record_usage(response.usage, model, provider, name)
         parsed_response = response.choices[0].message.parsed
         if parsed_response is None:
             raise ValueError("Failed to parse response")
-        return parsed_response
+        yield parsed_response
 
-    @staticmethod
-    async def generate_embedding(client: AsyncOpenAI, text: str) -> List[float]:
-        response = await client.embeddings.create(
-            model="text-embedding-3-large", input=text
-        )
-        return response.data[0].embedding
+    @classmethod
+    async def generate_embedding(
+        cls, client: AsyncOpenAI, text: str, dimensions: Optional[int] = None
+    ) -> np.ndarray:
+        if Config.EMBEDDING_BATCH_ENABLED:
+            # Concurrent callers share one embeddings.create call per batching window
+            batchers = cls._embedding_batchers.setdefault(client, {})
+            batcher = batchers.get(dimensions)
+            if batcher is None:
+                batcher = EmbeddingBatcher(
+                    client,
+                    EMBEDDING_MODEL,
+                    window=Config.EMBEDDING_BATCH_WINDOW_MS / 1000,
+                    max_batch_size=Config.EMBEDDING_BATCH_MAX_SIZE,
+                    max_tokens=Config.EMBEDDING_BATCH_MAX_TOKENS,
+                    dimensions=dimensions,
+                )
+                batchers[dimensions] = batcher
+            return await batcher.embed(text)
+        params = {"dimensions": dimensions} if dimensions else {}
+        async with UpstreamScheduler.slot(EMBEDDING_MODEL, estimate_tokens(text)) as reservation:
+            response = await OpenAIClient.bounded(
+                client,
+                lambda bounded_client, options: bounded_client.embeddings.create(
+                    model=EMBEDDING_MODEL, input=text, encoding_format="base64", **params, **options
+                )
+            )
+            if reservation is not None:
+                reservation.record_usage(response.usage)
+        record_usage(response.usage, EMBEDDING_MODEL)
+        return from_base64(response.data[0].embedding)
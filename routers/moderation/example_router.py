@@ -59,4 +59,9 @@ class ContentModerationRouter(BaseRouter):
     {{ prompt }}
     """
     input_schema = LLMRouterInput
-    output_schema = LLMRouterOutput
\ No newline at end of file
+    output_schema = LLMRouterOutput
+
+    @classmethod
+    def confidence_check(cls, response_output: LLMRouterOutput) -> bool:
+        # Flagging and approving at once (or neither) means the answer should be escalated
+        return response_output.flag_content != response_output.approve_content
@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import logfire
+from config import Config, Provider
+from deadlines import remaining
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+class SchedulerSaturated(Exception):
+    """Raised when a call cannot be admitted soon enough; callers should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Upstream capacity exhausted, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, limit_per_minute: int):
+        self.capacity = float(limit_per_minute)
+        self.rate = limit_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until the bucket holds amount, assuming nothing else consumes from it."""
+        self._refill()
+        return max(amount - self.available, 0.0) / self.rate
+
+    def wait_time(self, amount: float) -> float:
+        # Oversized requests only wait for a full bucket rather than forever
+        return self.time_until(min(amount, self.capacity))
+
+    def consume(self, amount: float):
+        self._refill()
+        self.available -= amount
+
+
+class ModelLimiter:
+    """Admits calls for one model in priority order while both its request and token buckets allow."""
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queue: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    def estimated_wait(self, tokens: int, priority: Optional[int] = None) -> float:
+        """Seconds until a call would be admitted after the waiting calls served before it."""
+        ahead = [
+            entry for entry in self._queue
+            if not entry[3].done() and (priority is None or entry[0] <= priority)
+        ]
+        return max(
+            self.requests.time_until(len(ahead) + 1),
+            self.tokens.time_until(sum(entry[2] for entry in ahead) + min(tokens, self.tokens.capacity)),
+        )
+
+    async def acquire(self, tokens: int, priority: int, max_wait: float = Config.SCHEDULER_MAX_WAIT):
+        # Fail at once rather than queue a call that would time out waiting anyway
+        if len(self._queue) >= Config.SCHEDULER_MAX_QUEUE_DEPTH:
+            raise SchedulerSaturated(self.estimated_wait(tokens, priority))
+        wait = self.estimated_wait(tokens, priority)
+        if wait > max_wait:
+            raise SchedulerSaturated(wait)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), tokens, future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            raise SchedulerSaturated(self.estimated_wait(tokens, priority))
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        # Correct the estimate once the API reports real usage
+        self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def _dispatch(self):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        while self._queue:
+            _, _, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            future.set_result(None)
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+
+class Reservation:
+    def __init__(self, limiter: ModelLimiter, estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+
+    def record_usage(self, usage) -> None:
+        if usage is not None:
+            self.limiter.record_usage(self.estimated_tokens, usage.total_tokens)
+
+
+class UpstreamScheduler:
+    """Rate-limit-aware admission control in front of OpenAI calls.
+
+    Each model gets request- and token-per-minute buckets. Waiting calls are served by provider
+    priority (lower first) and then arrival order. When the queue is full or a call would wait
+    longer than SCHEDULER_MAX_WAIT or its request's deadline allows, SchedulerSaturated is raised so
+    the API can answer 503 at once.
+    """
+
+    _limiters: Dict[str, ModelLimiter] = {}
+
+    @classmethod
+    def get_limiter(cls, model: str) -> ModelLimiter:
+        limiter = cls._limiters.get(model)
+        if limiter is None:
+            limits = Config.OPENAI_RATE_LIMITS.get(model, {})
+            # Limits are per account, so each worker process admits an equal share
+            limiter = ModelLimiter(
+                model,
+                rpm=max(limits.get("rpm", Config.SCHEDULER_DEFAULT_RPM) // Config.WORKERS, 1),
+                tpm=max(limits.get("tpm", Config.SCHEDULER_DEFAULT_TPM) // Config.WORKERS, 1),
+            )
+            cls._limiters[model] = limiter
+        return limiter
+
+    @classmethod
+    @asynccontextmanager
+    async def slot(
+        cls, model: str, estimated_tokens: int, provider: Optional[Provider] = None
+    ) -> AsyncIterator[Optional[Reservation]]:
+        if not Config.SCHEDULER_ENABLED:
+            yield None
+            return
+        limiter = cls.get_limiter(model)
+        priority = Config.PROVIDER_PRIORITIES.get(provider, Config.SCHEDULER_DEFAULT_PRIORITY)
+        # Waiting past the request's deadline would only spend quota on an answer nobody reads
+        left = remaining()
+        max_wait = Config.SCHEDULER_MAX_WAIT if left is None else min(Config.SCHEDULER_MAX_WAIT, left)
+        started = time.monotonic()
+        await limiter.acquire(estimated_tokens, priority, max_wait)
+        queued = time.monotonic() - started
+        if queued > 0.1:
+            logfire.info("Upstream call queued", extra={"model": model, "queued_seconds": queued})
+        yield Reservation(limiter, estimated_tokens)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, float]]:
+        return {
+            model: {
+                "queue_depth": limiter.queue_depth(),
+                "available_requests": limiter.requests.available,
+                "available_tokens": limiter.tokens.available,
+            }
+            for model, limiter in cls._limiters.items()
+        }
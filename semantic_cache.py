@@ -0,0 +1,132 @@
+import os
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import logfire
+from cache import RedisPool, CACHE_PREFIX, serialize, deserialize
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+SEMANTIC_CACHE_REDIS = os.getenv("SEMANTIC_CACHE_REDIS", "false").lower() == "true"
+SEMANTIC_CACHE_PREFIX = f"{CACHE_PREFIX}semantic:"
+# Best-match similarities are bucketed in steps of 0.05 for tuning thresholds
+SIMILARITY_BUCKETS = 20
+
+
+class SemanticIndex:
+    """Brute-force cosine-similarity index over normalized input embeddings for one task or router.
+
+    Vectors live in a preallocated float32 matrix; once full, the oldest entries are overwritten.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._matrix: Optional[np.ndarray] = None
+        self._outputs: List[Optional[Dict[str, Any]]] = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self.hits = 0
+        self.misses = 0
+        self.similarity_histogram = [0] * SIMILARITY_BUCKETS
+
+    def search(self, vector: np.ndarray) -> Tuple[Optional[Dict[str, Any]], float]:
+        if self._size == 0 or self._matrix.shape[1] != vector.shape[0]:
+            return None, 0.0
+        scores = self._matrix[:self._size] @ vector
+        best = int(np.argmax(scores))
+        return self._outputs[best], float(scores[best])
+
+    def add(self, vector: np.ndarray, output: Dict[str, Any]):
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self._size = 0
+            self._next = 0
+        self._matrix[self._next] = vector
+        self._outputs[self._next] = output
+        self._next = (self._next + 1) % self.max_entries
+        self._size = min(self._size + 1, self.max_entries)
+
+    def record(self, similarity: float, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        bucket = min(max(int(similarity * SIMILARITY_BUCKETS), 0), SIMILARITY_BUCKETS - 1)
+        self.similarity_histogram[bucket] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "similarity_histogram": {
+                f"{bucket / SIMILARITY_BUCKETS:.2f}": count
+                for bucket, count in enumerate(self.similarity_histogram)
+            },
+        }
+
+
+class SemanticCache:
+    """Reuses outputs of previous inputs whose embeddings are close enough to a new input.
+
+    Indexes are kept per task/router in process. With SEMANTIC_CACHE_REDIS enabled, entries are also
+    appended to a capped Redis list so other processes and restarts start from a warm index.
+    """
+
+    _indexes: Dict[str, SemanticIndex] = {}
+    _load_locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @classmethod
+    async def _get_index(cls, name: str) -> SemanticIndex:
+        index = cls._indexes.get(name)
+        if index is not None:
+            return index
+        lock = cls._load_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            index = cls._indexes.get(name)
+            if index is None:
+                index = SemanticIndex(SEMANTIC_CACHE_MAX_ENTRIES)
+                if SEMANTIC_CACHE_REDIS:
+                    redis = RedisPool.get_client()
+                    for entry in await redis.lrange(f"{SEMANTIC_CACHE_PREFIX}{name}", 0, -1):
+                        stored = deserialize(entry)
+                        index.add(stored["vector"], stored["output"])
+                    logger.info(f"Loaded semantic cache index {name} ({index.stats()['entries']} entries)")
+                cls._indexes[name] = index
+        return index
+
+    @classmethod
+    async def lookup(cls, name: str, vector: np.ndarray, threshold: float) -> Optional[Dict[str, Any]]:
+        index = await cls._get_index(name)
+        output, similarity = index.search(cls._normalize(vector))
+        hit = output is not None and similarity >= threshold
+        index.record(similarity, hit)
+        logfire.info("Semantic cache lookup", extra={"name": name, "similarity": similarity, "hit": hit})
+        return output if hit else None
+
+    @classmethod
+    async def store(cls, name: str, vector: np.ndarray, output: Dict[str, Any]):
+        vector = cls._normalize(vector)
+        index = await cls._get_index(name)
+        index.add(vector, output)
+        if SEMANTIC_CACHE_REDIS:
+            redis = RedisPool.get_client()
+            key = f"{SEMANTIC_CACHE_PREFIX}{name}"
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, serialize({"vector": vector, "output": output}))
+                pipe.ltrim(key, -SEMANTIC_CACHE_MAX_ENTRIES, -1)
+                await pipe.execute()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, Any]]:
+        return {name: index.stats() for name, index in cls._indexes.items()}
@@ -1,6 +1,7 @@
 from typing import List, Optional
 from pydantic import BaseModel, Field
-from base import BaseTask, ProviderTaskRegistry
+from base import ProviderTaskRegistry
+from map_reduce import MapReduceTask
 from config import Provider
 
 class SummaryParams(BaseModel):
@@ -17,8 +18,12 @@ class SummarizationTaskInput(BaseModel):
 class SummarizationTaskOutput(BaseModel):
     summary_params: SummaryParams = Field(..., description="Parameters for the generated summary")
 
+class ChunkSummary(BaseModel):
+    summary: str = Field(..., description="Summary of this section of the content")
+    key_points: List[str] = Field(..., description="The most important points of this section")
+
 @ProviderTaskRegistry.register(Provider.SUMMARIZATION)
-class GenericSummarizationTask(BaseTask):
+class GenericSummarizationTask(MapReduceTask):
     name = "generic_summarization_task"
     prompt_template = """
     You are an AI assistant tasked with summarizing content. Your role is to analyze the given content and provide a concise summary along with key points and relevant categories.
@@ -79,5 +84,49 @@ class GenericSummarizationTask(BaseTask):
     Remember, the goal is to create an informative and concise summary that captures the essence of the given content. Focus on the most important information and ensure that your summary is easy to understand.
     """
 
+    # Used instead of prompt_template when the content is too long for a single prompt
+    map_template = """
+    You are an AI assistant summarizing one section of a longer document. Other sections are summarized separately and combined afterwards.
+
+    Section:
+    {{ chunk }}
+
+    {% if focus_areas %}
+    Focus areas:
+    {% for area in focus_areas %}
+    - {{ area }}
+    {% endfor %}
+    {% endif %}
+
+    Provide a faithful summary of this section and its most important points. Do not add information that is not in the section.
+    """
+
+    reduce_template = """
+    You are an AI assistant tasked with summarizing content. The content was too long to read at once, so each of its sections has already been summarized, in order, below. Combine them into a single summary of the whole content along with key points and relevant categories.
+
+    Section summaries:
+    {% for section in chunk_summaries %}
+    Section {{ loop.index }}:
+    {{ section.summary }}
+    {% for point in section.key_points %}
+    - {{ point }}
+    {% endfor %}
+    {% endfor %}
+
+    {% if max_length %}
+    Maximum summary length: {{ max_length }} characters
+    {% endif %}
+
+    {% if focus_areas %}
+    Focus areas:
+    {% for area in focus_areas %}
+    - {{ area }}
+    {% endfor %}
+    {% endif %}
+
+    Create a concise, descriptive title, a clear and coherent summary of the whole content, 3-5 key points unless the content requires more, and relevant categories or tags.
+    """
+
     input_schema = SummarizationTaskInput
-    output_schema = SummarizationTaskOutput
\ No newline at end of file
+    output_schema = SummarizationTaskOutput
+    map_output_schema = ChunkSummary
\ No newline at end of file
@@ -1,9 +1,18 @@
-from jinja2 import Template
+from typing import Dict
+from jinja2 import Environment, Template
 
 class TemplateRenderer:
-    @staticmethod
-    def render(template: str, **kwargs) -> str:
-        return Template(template).render(**kwargs)
-    
-    
-    
\ No newline at end of file
+    _environment = Environment()
+    _compiled: Dict[str, Template] = {}
+
+    @classmethod
+    def compile(cls, template: str) -> Template:
+        compiled = cls._compiled.get(template)
+        if compiled is None:
+            compiled = cls._environment.from_string(template)
+            cls._compiled[template] = compiled
+        return compiled
+
+    @classmethod
+    def render(cls, template: str, **kwargs) -> str:
+        return cls.compile(template).render(**kwargs)
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+import cache
+from base import ProviderRouterRegistry
+from cache import LocalCache, RedisPool
+from config import Provider
+from loaders import load_routers, load_tasks
+
+load_tasks()
+load_routers()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """A fresh in-memory Redis and local cache for the test."""
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(RedisPool, "_client", client)
+    local_cache = LocalCache(cache.LOCAL_CACHE_MAX_ENTRIES, cache.LOCAL_CACHE_MAX_BYTES, cache.LOCAL_CACHE_TTL)
+    monkeypatch.setattr(cache, "local_cache", local_cache)
+    return client
+
+
+@pytest.fixture
+def moderation_routers():
+    """Register copies of the moderation router under new names, removed after the test."""
+    base = ProviderRouterRegistry.get_router(Provider.MODERATION, "content_moderation_router")
+    registered = []
+
+    def register(name: str, **attributes):
+        router_class = type(name, (base,), {"name": name, **attributes})
+        ProviderRouterRegistry.register(Provider.MODERATION)(router_class)
+        registered.append(name)
+        return router_class
+
+    yield register
+    for name in registered:
+        ProviderRouterRegistry._providers[Provider.MODERATION].pop(name, None)
@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from application import Application
+from config import Provider
+from deadlines import DeadlineExceeded
+from embeddings import EmbeddingFormat, EmbeddingMode
+
+REQUEST = {"context": "forum", "prompt": "embedding deadline test"}
+
+
+class ConnectedRequest:
+    """A request whose client never disconnects."""
+
+    url = SimpleNamespace(path="/api/v1/moderation/router/embedding_deadline_router")
+
+    async def receive(self):
+        await asyncio.Event().wait()
+
+
+def test_inline_embedding_is_bounded_by_the_request_deadline(fake_redis, moderation_routers):
+    embedding_cancelled = asyncio.Event()
+
+    async def attach_embedding(cls, client, output):
+        try:
+            await asyncio.sleep(10.0)
+        except asyncio.CancelledError:
+            embedding_cancelled.set()
+            raise
+        return output
+
+    moderation_routers("embedding_deadline_router", attach_embedding=classmethod(attach_embedding))
+
+    async def cached_router(provider, router_name, request, embed):
+        # A result cached without its embedding, which the inline mode fills in
+        return {"router_type": router_name, "router_data": {"flag_content": False}, "router_embedding": None}
+
+    application = SimpleNamespace(cached_router=cached_router)
+
+    async def run():
+        # Whichever of the request's and the shared call's waits notices first, the result is a 504
+        with pytest.raises((DeadlineExceeded, HTTPException)) as error:
+            await Application.process_router(
+                application,
+                ConnectedRequest(),
+                Provider.MODERATION,
+                "embedding_deadline_router",
+                REQUEST,
+                embedding_format=EmbeddingFormat.FLOAT,
+                embedding=EmbeddingMode.INLINE,
+                x_request_timeout=0.5,
+            )
+        # Let the cancellation reach the shared embedding call
+        await asyncio.sleep(0.05)
+        return error.value
+
+    error = asyncio.run(run())
+    assert not isinstance(error, HTTPException) or error.status_code == 504
+    assert embedding_cancelled.is_set()
@@ -0,0 +1,49 @@
+import asyncio
+
+from api_handler import APIHandler
+from base import ProviderTaskRegistry
+from cache import CACHE_EXPIRATION, LocalCache, make_cache_key
+from config import Provider
+from map_reduce import map_version
+
+TASK_NAME = "generic_summarization_task"
+
+
+def test_local_cache_keeps_entries_no_longer_than_its_ttl():
+    local_cache = LocalCache(max_entries=10, max_bytes=1024, ttl=0)
+    local_cache.set("key", {"value": 1}, 16, CACHE_EXPIRATION)
+    assert local_cache.get("key") is None
+
+
+def test_purge_covers_map_chunk_summaries(fake_redis):
+    task_class = ProviderTaskRegistry.get_task(Provider.SUMMARIZATION, TASK_NAME)
+    result_key = make_cache_key("process_task", {
+        "provider": Provider.SUMMARIZATION,
+        "task_name": TASK_NAME,
+        "version": task_class.cache_version,
+        "request": {"content": "text"},
+    })
+    chunk_keys = [
+        make_cache_key("map_chunk", {
+            "provider": Provider.SUMMARIZATION,
+            "task_name": TASK_NAME,
+            "version": version,
+            "request": {"chunk": "text"},
+        })
+        for version in (map_version(task_class), "stale")
+    ]
+
+    async def run():
+        for key in [result_key, *chunk_keys]:
+            await fake_redis.set(key, b"{}")
+        inspected = await APIHandler.inspect_cache("task", Provider.SUMMARIZATION, TASK_NAME)
+        stale = await APIHandler.purge_cache("task", Provider.SUMMARIZATION, TASK_NAME, stale_only=True)
+        purged = await APIHandler.purge_cache("task", Provider.SUMMARIZATION, TASK_NAME)
+        return inspected, stale, purged, await fake_redis.keys("*")
+
+    inspected, stale, purged, left = asyncio.run(run())
+    assert inspected["keys"] == 1
+    assert inspected["map_chunks"]["versions"] == {map_version(task_class): 1, "stale": 1}
+    assert stale["deleted"] == 0 and stale["map_chunks"]["deleted"] == 1
+    assert purged["deleted"] == 1 and purged["map_chunks"]["deleted"] == 1
+    assert left == []
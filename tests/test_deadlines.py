@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+import pytest
+from openai import AsyncOpenAI, InternalServerError
+from pydantic import BaseModel
+
+from cache import SingleFlight
+from deadlines import set_timeout
+from openai_client import OpenAIClient
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def failing_client(requests):
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(500, json={"error": {"message": "boom"}})
+
+    return AsyncOpenAI(
+        api_key="sk-test",
+        base_url="http://upstream.test/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        max_retries=2,
+    )
+
+
+def test_shared_call_is_bounded_by_the_callers_deadline():
+    requests = []
+    client = failing_client(requests)
+    single_flight = SingleFlight()
+    messages = OpenAIClient.completion_messages("hello")
+
+    async def call():
+        set_timeout(10.0)
+        return await single_flight.do("key", lambda: OpenAIClient.parse(client, messages, Answer))
+
+    with pytest.raises(InternalServerError):
+        asyncio.run(call())
+    # No SDK retries under a deadline, and the HTTP timeout is what was left of it
+    assert len(requests) == 1
+    assert 0 < requests[0].extensions["timeout"]["read"] <= 10.0
+
+
+def test_joining_caller_extends_the_shared_deadline():
+    seen = []
+    single_flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        seen.append(OpenAIClient.request_options()["timeout"])
+        return "done"
+
+    async def caller(timeout):
+        set_timeout(timeout)
+        return await single_flight.do("key", work)
+
+    async def run():
+        return await asyncio.gather(caller(1.0), caller(5.0))
+
+    assert asyncio.run(run()) == ["done", "done"]
+    assert 1.0 < seen[0] <= 5.0
@@ -0,0 +1,57 @@
+import asyncio
+
+from api_handler import APIHandler
+from config import Config, Provider
+from embeddings import EmbeddingMode
+
+REQUEST = {"context": "forum", "prompt": "fan-out test"}
+
+
+def test_short_circuit_does_not_start_queued_routers(monkeypatch, fake_redis, moderation_routers):
+    names = [f"fanout_router_{index}" for index in range(4)]
+    for name in names:
+        moderation_routers(name)
+    monkeypatch.setattr(Config, "BATCH_CONCURRENCY", 1)
+    calls = []
+
+    async def process_router(provider, router_name, client, request, embed=None):
+        calls.append(router_name)
+        await asyncio.sleep(0.01)
+        return {
+            "router_type": router_name,
+            "router_data": {"flag_content": router_name == names[0]},
+            "router_embedding": None,
+        }
+
+    monkeypatch.setattr(APIHandler, "process_router", staticmethod(process_router))
+
+    async def run():
+        combined = await APIHandler.process_router_fanout(
+            Provider.MODERATION, names, None, REQUEST, short_circuit=True, embedding=EmbeddingMode.SKIP
+        )
+        # Give anything left in the background the chance to reach upstream
+        await asyncio.sleep(0.1)
+        return combined
+
+    combined = asyncio.run(run())
+    assert combined["short_circuited"]
+    assert combined["flagged_by"] == names[:1]
+    assert [combined["results"][name] for name in names[1:]] == [{"skipped": True}] * 3
+    assert calls == names[:1]
+
+
+def test_routers_keep_their_own_timeout(monkeypatch, fake_redis, moderation_routers):
+    moderation_routers("fanout_quick_router", timeout=0.05)
+    moderation_routers("fanout_patient_router")
+
+    async def process_router(provider, router_name, client, request, embed=None):
+        await asyncio.sleep(0.2)
+        return {"router_type": router_name, "router_data": {"flag_content": False}, "router_embedding": None}
+
+    monkeypatch.setattr(APIHandler, "process_router", staticmethod(process_router))
+    combined = asyncio.run(APIHandler.process_router_fanout(
+        Provider.MODERATION, ["fanout_quick_router", "fanout_patient_router"], None, REQUEST,
+        embedding=EmbeddingMode.SKIP
+    ))
+    assert combined["results"]["fanout_quick_router"]["error"]["status_code"] == 504
+    assert "result" in combined["results"]["fanout_patient_router"]
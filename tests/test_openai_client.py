@@ -0,0 +1,28 @@
+import asyncio
+import gc
+import weakref
+
+from openai import AsyncOpenAI
+
+from config import Config
+from deadlines import set_timeout
+from openai_client import OpenAIClient
+
+
+def test_per_client_caches_do_not_keep_clients_alive(monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_BATCH_ENABLED", True)
+    client = AsyncOpenAI(api_key="sk-test", base_url="http://upstream.test/v1")
+    collected = weakref.ref(client)
+
+    async def use():
+        set_timeout(1.0)
+        OpenAIClient.request_client(client)
+        embedding = asyncio.ensure_future(OpenAIClient.generate_embedding(client, "text"))
+        await asyncio.sleep(0)
+        embedding.cancel()
+
+    asyncio.run(use())
+    assert client in OpenAIClient._embedding_batchers and client in OpenAIClient._no_retry_clients
+    del client
+    gc.collect()
+    assert collected() is None
@@ -0,0 +1,129 @@
+import os
+import time
+import signal
+import logging
+from typing import Dict, Optional
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# Pause before replacing a worker that died, so a crash loop does not spin
+RESPAWN_DELAY = 1.0
+POLL_INTERVAL = 0.2
+# Time a worker gets past its shutdown budget for the last cleanup (cache flush, closing pools)
+# before the supervisor kills it
+SHUTDOWN_SLACK = 10
+
+
+class Server(uvicorn.Server):
+    """uvicorn.Server that starts the process's shutdown budget when it is told to exit.
+
+    Draining connections and the app's lifespan shutdown share the one budget of
+    timeout_graceful_shutdown seconds, so a slow drain leaves less time to the phases after it.
+    """
+
+    shutdown_deadline: Optional[float] = None
+
+    def handle_exit(self, sig, frame):
+        if Server.shutdown_deadline is None:
+            Server.shutdown_deadline = time.monotonic() + (self.config.timeout_graceful_shutdown or 0)
+        super().handle_exit(sig, frame)
+
+    @staticmethod
+    def shutdown_remaining(timeout: float) -> float:
+        """Seconds left of the shutdown budget, starting one of timeout if no signal started it."""
+        if Server.shutdown_deadline is None:
+            Server.shutdown_deadline = time.monotonic() + timeout
+        return max(Server.shutdown_deadline - time.monotonic(), 0.0)
+
+
+class WorkerPool:
+    """Serves one uvicorn config from several forked worker processes sharing a listening socket.
+
+    The app and the task/router registries are built before the fork, so workers start from a
+    preloaded copy instead of importing everything again. Redis and OpenAI pools are opened by each
+    worker's own lifespan. On SIGTERM or SIGINT every worker stops accepting connections and
+    drains its in-flight requests and background work within the config's
+    timeout_graceful_shutdown in total; stragglers are killed SHUTDOWN_SLACK seconds after that. Workers that die unexpectedly are replaced.
+    """
+
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self._pids: Dict[int, int] = {}  # pid -> worker number
+        self._should_exit = False
+
+    def run(self):
+        sock = self.config.bind_socket()
+        for number in range(self.workers):
+            self._spawn(sock, number)
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        logger.info(f"Started {self.workers} workers on {self.config.host}:{self.config.port} (parent {os.getpid()})")
+
+        while not self._should_exit:
+            for pid, number in self._reap():
+                logger.error(f"Worker {pid} exited unexpectedly, starting a replacement")
+                time.sleep(RESPAWN_DELAY)
+                self._spawn(sock, number)
+            time.sleep(POLL_INTERVAL)
+
+        self._shutdown()
+        sock.close()
+        logger.info("All workers stopped")
+
+    def _spawn(self, sock, number: int):
+        pid = os.fork()
+        if pid == 0:
+            # uvicorn installs its own handlers; drop the supervisor's before it starts
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                Server(self.config).run(sockets=[sock])
+            except BaseException:
+                logger.exception(f"Worker {os.getpid()} failed")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self._pids[pid] = number
+
+    def _reap(self):
+        """Collect exited workers, yielding (pid, worker number) for each."""
+        while self._pids:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            number = self._pids.pop(pid, None)
+            self._mark_dead(pid)
+            if number is not None:
+                yield pid, number
+
+    def _handle_exit(self, signum, frame):
+        self._should_exit = True
+
+    def _shutdown(self):
+        # Workers share one budget of timeout_graceful_shutdown between draining connections and
+        # their lifespan shutdown (see Server), so they should all be gone shortly after it
+        deadline = time.monotonic() + (self.config.timeout_graceful_shutdown or 0) + SHUTDOWN_SLACK
+        for pid in self._pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        while self._pids and time.monotonic() < deadline:
+            list(self._reap())
+            time.sleep(POLL_INTERVAL)
+        for pid in list(self._pids):
+            logger.warning(f"Worker {pid} did not stop in time, killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._mark_dead(pid)
+        self._pids.clear()
+
+    @staticmethod
+    def _mark_dead(pid: int):
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(pid)